@@ -4,6 +4,8 @@ import click
 import textgrid
 import tqdm
 
+from interval_tier import IntervalTier
+
 
 @click.command(help='Align words tiers in TextGrids to phones tiers')
 @click.option('--tg', required=True, help='Path to TextGrids (2-tier or 3-tier format)')
@@ -34,19 +36,18 @@ def align_tg_words(tg, dictionary, out, overwrite):
     for tgfile in tqdm.tqdm(tg_path_in.glob('*.TextGrid')):
         tg = textgrid.TextGrid()
         tg.read(tgfile)
-        old_words_tier: textgrid.IntervalTier = tg[-2]
+        old_words_tier = IntervalTier.from_textgrid(tg[-2])
         if old_words_tier.name != 'words':
             raise ValueError(
                 f'Invalid tier name or order in \'{tgfile}\'. '
                 f'The words tier should be the 1st tier of a 2-tier TextGrid, '
                 f'or the 2nd tier of a 3-tier TextGrid.'
             )
-        phones_tier: textgrid.IntervalTier = tg[-1]
-        new_words_tier = textgrid.IntervalTier(name='words')
-        word_seq = [i.mark for i in old_words_tier]
+        phones_tier = IntervalTier.from_textgrid(tg[-1])
+        word_seq = old_words_tier.marks
         word_div = []
-        ph_seq = [i.mark for i in phones_tier]
-        ph_dur = [i.duration() for i in phones_tier]
+        ph_seq = phones_tier.marks
+        ph_dur = phones_tier.durations().tolist()
         idx = 0
         for i, word in enumerate(word_seq):
             if word not in dictionary:
@@ -68,14 +69,13 @@ def align_tg_words(tg, dictionary, out, overwrite):
                 f'Error: word_div does not sum to number of phones in \'{tgfile}\'. '
                 f'Check the warnings above for more detailed mismatching positions.'
             )
-        start = 0.
+        bounds = [0.]
         idx = 0
         for j in range(len(word_seq)):
-            end = start + sum(ph_dur[idx: idx + word_div[j]])
-            new_words_tier.add(minTime=start, maxTime=end, mark=word_seq[j])
-            start = end
+            bounds.append(bounds[-1] + sum(ph_dur[idx: idx + word_div[j]]))
             idx += word_div[j]
-        tg.tiers[-2] = new_words_tier
+        new_words_tier = IntervalTier(name='words', min_times=bounds[:-1], max_times=bounds[1:], marks=word_seq)
+        tg.tiers[-2] = new_words_tier.to_textgrid()
         tg_file_out = tg_path_out / tgfile.name
         if tg_file_out.exists() and not overwrite:
             raise FileExistsError(str(tg_file_out))
@@ -3,12 +3,13 @@ import pathlib
 import random
 
 import click
-import librosa
 import numpy as np
 import soundfile
 import tqdm
 from textgrid import TextGrid
 
+from audio_cache import AudioCache, load_audio
+
 
 @click.command(help='Collect phoneme alignments into transcriptions.csv')
 @click.option('--wavs', required=True, help='Path to the segments directory')
@@ -18,7 +19,10 @@ from textgrid import TextGrid
               help='Do not insert silence around segments')
 @click.option('--wav_subtype', default="PCM_16", show_default=True,
               help='WAV subtype')
-def build_dataset(wavs, tg, dataset, skip_silence_insertion, wav_subtype):
+@click.option('--cache_dir', help='Directory to cache decoded audio across runs')
+@click.option('--audio_cache_size', type=float, default=4, show_default=True,
+              help='Size limit of the decoded audio in the cache, in GiB (audio is not cached if the files do not fit)')
+def build_dataset(wavs, tg, dataset, skip_silence_insertion, wav_subtype, cache_dir, audio_cache_size):
     wavs = pathlib.Path(wavs)
     tg_dir = pathlib.Path(tg)
     del tg
@@ -31,8 +35,11 @@ def build_dataset(wavs, tg, dataset, skip_silence_insertion, wav_subtype):
     samplerate = 44100
     min_sil = int(0.1 * samplerate)
     max_sil = int(0.5 * samplerate)
+    audio_cache = AudioCache(cache_dir, max_size=int(audio_cache_size * (1 << 30))) if cache_dir is not None else None
+    if audio_cache is not None:
+        audio_cache.reserve(filelist, [samplerate])
     for wavfile in tqdm.tqdm(filelist):
-        y, _ = librosa.load(wavfile, sr=samplerate, mono=True)
+        y, _ = load_audio(wavfile, sr=samplerate, cache=audio_cache)
         tgfile = tg_dir / wavfile.with_suffix('.TextGrid').name
         tg = TextGrid()
         tg.read(str(tgfile))
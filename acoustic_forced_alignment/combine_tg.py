@@ -10,6 +10,8 @@ import soundfile
 import textgrid
 import tqdm
 
+from interval_tier import IntervalTier
+
 
 def remove_suffix(string, suffix_pattern):
     match = re.search(f'{suffix_pattern}$', string)
@@ -18,6 +20,13 @@ def remove_suffix(string, suffix_pattern):
     return string[:-len(match.group())]
 
 
+def lay_out(tier, start, end):
+    # Intervals of the tier placed one after another from start, the last one ending at end
+    bounds = numpy.cumsum(numpy.concatenate([[start], tier.durations()]))
+    bounds[-1] = end
+    return bounds[:-1], bounds[1:], tier.marks
+
+
 @click.command(help='Combine segmented 2-tier TextGrids and wavs into 3-tier TextGrids and long wavs')
 @click.option(
     '--wavs', required=True,
@@ -59,9 +68,7 @@ def combine_tg(wavs, tg, out, suffix, wav_subtype, overwrite):
     for name, files in tqdm.tqdm(sorted(filelist.items(), key=lambda kv: kv[0])):
         wav_segments = []
         tg = textgrid.TextGrid()
-        sentences_tier = textgrid.IntervalTier(name='sentences')
-        words_tier = textgrid.IntervalTier(name='words')
-        phones_tier = textgrid.IntervalTier(name='phones')
+        sentences, words, phones = [], [], []
         sentence_start = 0.
         sr = None
         for tg_file in natsort.natsorted(files):
@@ -73,29 +80,20 @@ def combine_tg(wavs, tg, out, suffix, wav_subtype, overwrite):
                 assert sr_ == sr, f'Cannot combine \'{tg_file.stem}\': incompatible samplerate ({sr_} != {sr})'
             sentence_end = waveform.shape[0] / sr + sentence_start
             wav_segments.append(waveform)
-            sentences_tier.add(minTime=sentence_start, maxTime=sentence_end, mark=wav_file.stem)
+            sentences.append(([sentence_start], [sentence_end], [wav_file.stem]))
             sentence_tg = textgrid.TextGrid()
             sentence_tg.read(tg_file)
-            start = sentence_start
-            for j, word in enumerate(sentence_tg[0]):
-                if j == len(sentence_tg[0]) - 1:
-                    end = sentence_end
-                else:
-                    end = start + word.duration()
-                words_tier.add(minTime=start, maxTime=end, mark=word.mark)
-                start = end
-            start = sentence_start
-            for j, phone in enumerate(sentence_tg[1]):
-                if j == len(sentence_tg[1]) - 1:
-                    end = sentence_end
-                else:
-                    end = start + phone.duration()
-                phones_tier.add(minTime=start, maxTime=end, mark=phone.mark)
-                start = end
+            words.append(lay_out(IntervalTier.from_textgrid(sentence_tg[0]), sentence_start, sentence_end))
+            phones.append(lay_out(IntervalTier.from_textgrid(sentence_tg[1]), sentence_start, sentence_end))
             sentence_start = sentence_end
-        tg.append(sentences_tier)
-        tg.append(words_tier)
-        tg.append(phones_tier)
+        for tier_name, intervals in [('sentences', sentences), ('words', words), ('phones', phones)]:
+            min_times, max_times, marks = zip(*intervals)
+            tg.append(IntervalTier(
+                name=tier_name,
+                min_times=numpy.concatenate(min_times),
+                max_times=numpy.concatenate(max_times),
+                marks=[mark for tier_marks in marks for mark in tier_marks]
+            ).to_textgrid())
 
         tg_file_out = combined_path_out / f'{name}.TextGrid'
         wav_file_out = tg_file_out.with_suffix('.wav')
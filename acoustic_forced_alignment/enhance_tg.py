@@ -1,12 +1,97 @@
 import pathlib
 
 import click
-import librosa
 import numpy as np
 import parselmouth as pm
 import textgrid as tg
 import tqdm
 
+from audio_cache import AudioCache
+from feature_store import FeatureStore
+from interval_tier import IntervalTier
+
+
+def window_rms(power, n_channels, x1, dx, from_times, to_times):
+    """
+    Same as Sound.get_rms(from_time, to_time) for every pair of times, in O(1) per window
+    from power, the prefix sums of squared samples summed over channels (with a leading 0).
+    """
+    n_samples = power.shape[0] - 1
+    # Sampled_getWindowSamples in Praat (1-based sample indices)
+    imin = np.maximum(np.ceil((from_times - x1) / dx + 1.).astype(np.int64), 1)
+    imax = np.minimum(np.floor((to_times - x1) / dx + 1.).astype(np.int64), n_samples)
+    n = imax - imin + 1
+    with np.errstate(invalid='ignore'):
+        return np.where(
+            n >= 1,
+            np.sqrt((power[np.clip(imax, 0, n_samples)] - power[np.clip(imin - 1, 0, n_samples)])
+                    / (np.maximum(n, 1) * n_channels)),
+            np.nan
+        )
+
+
+def advance(value, step, count):
+    # value with step added count times, rounded the same as adding it one by one
+    return float(np.cumsum(np.concatenate([[value], np.full(count, step)]))[-1])
+
+
+def count_voiced_steps(start, end, time_step, voiced, block_size=256):
+    """
+    Number of steps of time_step that a boundary at start can move forward while it stays before
+    end - time_step and the frame under it is voiced. The positions the boundary would pass are
+    accumulated like repeated additions of time_step and checked block_size at a time.
+    """
+    steps = 0
+    pos = start
+    while True:
+        positions = np.cumsum(np.concatenate([[pos], np.full(block_size - 1, time_step)]))
+        frames = np.minimum((positions / time_step).astype(np.int64), voiced.shape[0] - 1)
+        stop = ~(positions < end - time_step) | ~voiced[frames]
+        if stop.any():
+            return steps + int(np.argmax(stop))
+        steps += block_size
+        pos = positions[-1] + time_step
+
+
+def find_breath_ranges(min_time, max_time, time_step, win_size, min_len, is_breath, accept, block_size=256):
+    """
+    Slide a window of win_size from min_time to max_time by time_step and find the runs of windows where
+    is_breath holds, as (start, end) ranges of at least min_len that accept approves. After each run the
+    window restarts from its end. Window positions are accumulated step by step as floats, and is_breath
+    is evaluated on whole blocks of them at once.
+    """
+    ranges = []
+    br_start = None
+    win_pos = min_time
+    while win_pos + win_size <= max_time:
+        # Accumulated in order, the same as adding time_step to win_pos once per window
+        positions = np.cumsum(np.concatenate([[win_pos], np.full(block_size, time_step)]))
+        in_range = positions[:-1] + win_size <= max_time
+        n = block_size if in_range.all() else int(np.argmin(in_range))
+        breath = is_breath(positions[:n])
+        first = 0
+        if br_start is None:
+            starts = np.flatnonzero(breath)
+            if starts.shape[0] == 0:
+                win_pos = positions[n]
+                continue
+            first = starts[0]
+            br_start = float(positions[first])
+        ends = np.flatnonzero(~breath[first:])
+        if ends.shape[0] == 0:
+            win_pos = positions[n]
+            continue
+        br_end = float(positions[first + ends[0]]) + win_size - time_step
+        if br_end - br_start >= min_len and accept(br_start, br_end):
+            ranges.append((br_start, br_end))
+        br_start = None
+        win_pos = br_end + time_step
+    if br_start is not None:
+        br_end = float(win_pos) + win_size - time_step
+        if br_end - br_start >= min_len and accept(br_start, br_end):
+            ranges.append((br_start, br_end))
+    return ranges
+
 
 @click.command(help='Enhance and finish the TextGrids')
 @click.option('--wavs', required=True, help='Path to the segments directory')
@@ -31,10 +116,16 @@ import tqdm
               help='Threshold of voicing for detecting breath')
 @click.option('--br_win_sz', type=float, default=0.05, show_default=True,
               help='Size of sliding window in seconds for detecting breath')
+@click.option('--workers', type=int, default=1, show_default=True,
+              help='Number of processes for pitch extraction (0 for all cores)')
+@click.option('--cache_dir', help='Directory to cache decoded audio and extracted features across runs')
+@click.option('--audio_cache_size', type=float, default=4, show_default=True,
+              help='Size limit of the decoded audio in the cache, in GiB (audio is not cached if the files do not fit)')
 def enhance_tg(
         wavs, dictionary, src, dst,
         f0_min, f0_max, br_len, br_db, br_centroid,
-        time_step, min_space, voicing_thresh_vowel, voicing_thresh_breath, br_win_sz
+        time_step, min_space, voicing_thresh_vowel, voicing_thresh_breath, br_win_sz, workers, cache_dir,
+        audio_cache_size
 ):
     wavs = pathlib.Path(wavs)
     dict_path = pathlib.Path(dictionary)
@@ -52,162 +143,116 @@ def enhance_tg(
         phoneme_set.update(phonemes)
 
     filelist = list(wavs.glob('*.wav'))
-    for wavfile in tqdm.tqdm(filelist):
+    audio_cache = AudioCache(cache_dir, max_size=int(audio_cache_size * (1 << 30))) if cache_dir is not None else None
+    if audio_cache is not None:
+        # The spectral centroid is computed at 24 kHz
+        audio_cache.reserve(filelist, [24000])
+    features = FeatureStore(cache_dir, audio_cache=audio_cache, num_workers=workers)
+    # Pitch of the following files is extracted in a process pool while the current one is processed.
+    # One analysis serves both voicing thresholds.
+    f0s = features.pitch(
+        filelist, time_step, f0_min, f0_max, voicing_threshold=(voicing_thresh_breath, voicing_thresh_vowel)
+    )
+    for wavfile, (f0_voicing_breath, f0_voicing_vowel) in tqdm.tqdm(zip(filelist, f0s), total=len(filelist)):
         tgfile = src / wavfile.with_suffix('.TextGrid').name
         textgrid = tg.TextGrid()
         textgrid.read(str(tgfile))
-        words = textgrid[0]
-        phones = textgrid[1]
+        words = IntervalTier.from_textgrid(textgrid[0])
+        phones = IntervalTier.from_textgrid(textgrid[1])
         sound = pm.Sound(str(wavfile))
-        f0_voicing_breath = sound.to_pitch_ac(
-            time_step=time_step,
-            voicing_threshold=voicing_thresh_breath,
-            pitch_floor=f0_min,
-            pitch_ceiling=f0_max,
-        ).selected_array['frequency']
-        f0_voicing_vowel = sound.to_pitch_ac(
-            time_step=time_step,
-            voicing_threshold=voicing_thresh_vowel,
-            pitch_floor=f0_min,
-            pitch_ceiling=f0_max,
-        ).selected_array['frequency']
-        y, sr = librosa.load(wavfile, sr=24000, mono=True)
-        hop_size = int(time_step * sr)
-        spectral_centroid = librosa.feature.spectral_centroid(y=y, sr=sr, n_fft=2048, hop_length=hop_size).squeeze(0)
+        power = np.concatenate([[0.], np.cumsum((sound.values ** 2).sum(axis=0))])
+        voiced = np.concatenate([[0], np.cumsum(~(f0_voicing_breath < f0_min))])
+
+        def is_breath(win_pos):
+            # No voiced frames and enough energy in each window
+            begin = np.minimum((win_pos / time_step).astype(np.int64), f0_voicing_breath.shape[0])
+            end = np.minimum(((win_pos + br_win_sz) / time_step).astype(np.int64), f0_voicing_breath.shape[0])
+            all_noisy = voiced[end] - voiced[begin] <= 0
+            rms = window_rms(power, sound.n_channels, sound.x1, sound.dx, win_pos, win_pos + br_win_sz)
+            rms_db = 20 * np.log10(np.clip(rms, a_min=1e-12, a_max=1))
+            return all_noisy & (rms_db >= br_db)
+
+        def accept_breath(br_start, br_end):
+            centroid = spectral_centroid[int(br_start / time_step): int(br_end / time_step)].mean()
+            return centroid >= br_centroid
+
+        def first_phones():
+            # Index of the first phone of each word
+            counts = [1 if mark in (None, '', 'AP') else len(dictionary[mark]) for mark in words.marks]
+            return np.cumsum([0] + counts)[:-1]
 
         # Fix long utterances
-        i = j = 0
-        while i < len(words):
-            word = words[i]
-            phone = phones[j]
-            if word.mark is not None and word.mark != '':
-                i += 1
-                j += len(dictionary[word.mark])
-                continue
+        voiced_vowel = ~(f0_voicing_vowel < f0_min)
+        word_phones = first_phones()
+        for i in np.flatnonzero(words.where(None, '')).tolist():
             if i == 0:
-                i += 1
-                j += 1
                 continue
-            prev_word = words[i - 1]
-            prev_phone = phones[j - 1]
+            j = word_phones[i]
             # Extend length of long utterances
-            while word.minTime < word.maxTime - time_step:
-                pos = min(f0_voicing_vowel.shape[0] - 1, int(word.minTime / time_step))
-                if f0_voicing_vowel[pos] < f0_min:
-                    break
-                prev_word.maxTime += time_step
-                prev_phone.maxTime += time_step
-                word.minTime += time_step
-                phone.minTime += time_step
-            i += 1
-            j += 1
+            steps = count_voiced_steps(words.min_times[i], words.max_times[i], time_step, voiced_vowel)
+            if steps > 0:
+                words.max_times[i - 1] = advance(words.max_times[i - 1], time_step, steps)
+                phones.max_times[j - 1] = advance(phones.max_times[j - 1], time_step, steps)
+                words.min_times[i] = advance(words.min_times[i], time_step, steps)
+                phones.min_times[j] = advance(phones.min_times[j], time_step, steps)
 
         # Detect aspiration
-        i = j = 0
-        while i < len(words):
-            word = words[i]
-            phone = phones[j]
-            if word.mark is not None and word.mark != '':
-                i += 1
-                j += len(dictionary[word.mark])
-                continue
-            if word.maxTime - word.minTime < br_len:
-                i += 1
-                j += 1
-                continue
-            ap_ranges = []
-            br_start = None
-            win_pos = word.minTime
-            while win_pos + br_win_sz <= word.maxTime:
-                all_noisy = (f0_voicing_breath[
-                             int(win_pos / time_step): int((win_pos + br_win_sz) / time_step)] < f0_min).all()
-                rms_db = 20 * np.log10(
-                    np.clip(sound.get_rms(from_time=win_pos, to_time=win_pos + br_win_sz), a_min=1e-12, a_max=1))
-                # print(win_pos, win_pos + br_win_sz, all_noisy, rms_db)
-                if all_noisy and rms_db >= br_db:
-                    if br_start is None:
-                        br_start = win_pos
-                else:
-                    if br_start is not None:
-                        br_end = win_pos + br_win_sz - time_step
-                        if br_end - br_start >= br_len:
-                            centroid = spectral_centroid[int(br_start / time_step): int(br_end / time_step)].mean()
-                            if centroid >= br_centroid:
-                                ap_ranges.append((br_start, br_end))
-                        br_start = None
-                        win_pos = br_end
-                win_pos += time_step
-            if br_start is not None:
-                br_end = win_pos + br_win_sz - time_step
-                if br_end - br_start >= br_len:
-                    centroid = spectral_centroid[int(br_start / time_step): int(br_end / time_step)].mean()
-                    if centroid >= br_centroid:
-                        ap_ranges.append((br_start, br_end))
+        word_phones = first_phones()
+        candidates = np.flatnonzero(words.where(None, '') & ~(words.durations() < br_len))
+        if candidates.shape[0] > 0:
+            # The spectral centroid is only read within the candidate spaces, plus one frame after each
+            spectral_centroid = features.spectral_centroid(
+                wavfile, time_step, sr=24000, n_fft=2048, regions=[
+                    (int(words.min_times[i] / time_step), int(words.max_times[i] / time_step) + 2)
+                    for i in candidates.tolist()
+                ]
+            )
+        split_words, split_phones = [], []
+        word_pieces, phone_pieces = [], []
+        for i in candidates.tolist():
+            j = word_phones[i]
+            word_min, word_max = words.min_times[i], words.max_times[i]
+            phone_min, phone_max = phones.min_times[j], phones.max_times[j]
+            ap_ranges = find_breath_ranges(word_min, word_max, time_step, br_win_sz, br_len, is_breath, accept_breath)
             # print(ap_ranges)
             if len(ap_ranges) == 0:
-                i += 1
-                j += 1
                 continue
-            words.removeInterval(word)
-            phones.removeInterval(phone)
-            if word.minTime < ap_ranges[0][0]:
-                words.add(minTime=word.minTime, maxTime=ap_ranges[0][0], mark=None)
-                phones.add(minTime=phone.minTime, maxTime=ap_ranges[0][0], mark=None)
-                i += 1
-                j += 1
+            split_words.append(i)
+            split_phones.append(j)
+            if word_min < ap_ranges[0][0]:
+                word_pieces.append((word_min, ap_ranges[0][0], None))
+                phone_pieces.append((phone_min, ap_ranges[0][0], None))
             for k, ap in enumerate(ap_ranges):
                 if k > 0:
-                    words.add(minTime=ap_ranges[k - 1][1], maxTime=ap[0], mark=None)
-                    phones.add(minTime=ap_ranges[k - 1][1], maxTime=ap[0], mark=None)
-                    i += 1
-                    j += 1
-                words.add(minTime=ap[0], maxTime=min(word.maxTime, ap[1]), mark='AP')
-                phones.add(minTime=ap[0], maxTime=min(word.maxTime, ap[1]), mark='AP')
-                i += 1
-                j += 1
-            if ap_ranges[-1][1] < word.maxTime:
-                words.add(minTime=ap_ranges[-1][1], maxTime=word.maxTime, mark=None)
-                phones.add(minTime=ap_ranges[-1][1], maxTime=phone.maxTime, mark=None)
-                i += 1
-                j += 1
-
-        # Remove short spaces
-        i = j = 0
-        while i < len(words):
-            word = words[i]
-            phone = phones[j]
-            if word.mark is not None and word.mark != '':
-                i += 1
-                j += (1 if word.mark == 'AP' else len(dictionary[word.mark]))
-                continue
-            if word.maxTime - word.minTime >= min_space:
-                word.mark = 'SP'
-                phone.mark = 'SP'
-                i += 1
-                j += 1
-                continue
-            if i == 0:
-                if len(words) >= 2:
-                    words[i + 1].minTime = word.minTime
-                    phones[j + 1].minTime = phone.minTime
-                    words.removeInterval(word)
-                    phones.removeInterval(phone)
-                else:
-                    break
-            elif i == len(words) - 1:
-                if len(words) >= 2:
-                    words[i - 1].maxTime = word.maxTime
-                    phones[j - 1].maxTime = phone.maxTime
-                    words.removeInterval(word)
-                    phones.removeInterval(phone)
-                else:
-                    break
-            else:
-                words[i - 1].maxTime = words[i + 1].minTime = (word.minTime + word.maxTime) / 2
-                phones[j - 1].maxTime = phones[j + 1].minTime = (phone.minTime + phone.maxTime) / 2
-                words.removeInterval(word)
-                phones.removeInterval(phone)
+                    word_pieces.append((ap_ranges[k - 1][1], ap[0], None))
+                    phone_pieces.append((ap_ranges[k - 1][1], ap[0], None))
+                word_pieces.append((ap[0], min(word_max, ap[1]), 'AP'))
+                phone_pieces.append((ap[0], min(word_max, ap[1]), 'AP'))
+            if ap_ranges[-1][1] < word_max:
+                word_pieces.append((ap_ranges[-1][1], word_max, None))
+                phone_pieces.append((ap_ranges[-1][1], phone_max, None))
+        words.delete(split_words)
+        phones.delete(split_phones)
+        if len(word_pieces) > 0:
+            words.insert(*zip(*word_pieces))
+            phones.insert(*zip(*phone_pieces))
+
+        # Remove short spaces. A short space is kept if it has grown long enough from the space before it
+        # being merged into it; the phones follow the decisions made on the words.
+        word_phones = first_phones()
+        short = words.where(None, '') & ~(words.durations() >= min_space)
+        merged = words.merge(np.flatnonzero(short), min_duration=min_space)
+        phones.merge(word_phones[merged])
+        word_phones = first_phones()
+        spaces = words.where(None, '') & ~(words.durations() < min_space)
+        words.set_marks(spaces, 'SP')
+        phones.set_marks(word_phones[spaces], 'SP')
+        textgrid.tiers[0] = words.to_textgrid()
+        textgrid.tiers[1] = phones.to_textgrid()
         textgrid.write(str(dst / tgfile.name))
+    if cache_dir is not None:
+        print(f'Audio cache: {audio_cache.summary()}')
+        print(f'Feature store: {features.summary()}')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,133 @@
+import pathlib
+
+import numpy as np
+
+from audio_cache import AudioCache, load_audio
+from disk_cache import DiskCache, hash_file, make_key
+from parselmouth_engine import ParselmouthEngine
+from resampler import default_resampler
+
+
+def region_mask(regions, n_frames):
+    if regions is None:
+        return np.ones(n_frames, dtype=bool)
+    mask = np.zeros(n_frames, dtype=bool)
+    for begin, end in regions:
+        mask[max(begin, 0): max(end, 0)] = True
+    return mask
+
+
+def centroid_frames(y, frames, sr, n_fft, hop_size, block_size=1024):
+    """
+    Spectral centroid of the given frames only, the same as the frames of librosa.feature.spectral_centroid
+    (centred, zero-padded). Each run of consecutive frames is analysed from its own slice of the waveform,
+    block_size frames at a time.
+    """
+    import librosa
+    centroid = np.empty(frames.shape[0])
+    runs = np.split(np.arange(frames.shape[0]), np.flatnonzero(np.diff(frames) != 1) + 1)
+    for run in runs:
+        for i in range(0, run.shape[0], block_size):
+            block = run[i: i + block_size]
+            # Samples of the centred frames, with the padding of librosa outside of the waveform
+            start = frames[block[0]] * hop_size - n_fft // 2
+            end = frames[block[-1]] * hop_size - n_fft // 2 + n_fft
+            segment = np.zeros(end - start, dtype=y.dtype)
+            segment[max(-start, 0): min(y.shape[0], end) - start] = y[max(start, 0): end]
+            spec = np.abs(librosa.stft(segment, n_fft=n_fft, hop_length=hop_size, center=False))
+            centroid[block] = librosa.feature.spectral_centroid(S=spec, sr=sr, n_fft=n_fft).squeeze(0)
+    return centroid
+
+
+class FeatureStore:
+    """
+    Frame-level features of audio files (pitch and spectral centroid), extracted once per file and kept
+    in a DiskCache as memory-mapped arrays, so that tools read only the frames they need.
+    Entries are keyed by the content hash of the file and the analysis parameters, so they are invalidated
+    when the file changes. Each entry declares its frame rate next to the feature.
+    Without cache_dir, features are extracted on every request.
+    Voicing strength is not stored: the tools decide voicing from the pitch at each voicing threshold, and
+    one analysis serves all thresholds. Neither is frame RMS: enhance_tg.py needs the RMS of windows starting
+    at arbitrary times, which it computes exactly from the cumulative power of the samples.
+    """
+
+    def __init__(self, cache_dir=None, max_size=2 << 30, audio_cache: AudioCache = None, num_workers=1):
+        # Shares the directory given by --cache_dir with the audio cache, in a subdirectory of its own
+        self.cache = DiskCache(pathlib.Path(cache_dir) / 'features', max_size=max_size) \
+            if cache_dir is not None else None
+        self.audio_cache = audio_cache
+        self.engine = ParselmouthEngine(num_workers=num_workers)
+
+    def _key(self, path, kind, *params):
+        if self.cache is None:
+            return None
+        return make_key('features', hash_file(path), kind, *params)
+
+    def _get(self, key, name):
+        if key is None:
+            return None
+        cached = self.cache.get(key, (name, 'frame_rate'))
+        if cached is None:
+            return None
+        return cached[0]
+
+    def _put(self, key, frame_rate, **arrays):
+        if key is not None:
+            self.cache.put(key, frame_rate=np.array([frame_rate]), **arrays)
+
+    def pitch(self, paths, time_step, f0_min, f0_max, voicing_threshold=0.45):
+        """
+        Parselmouth pitch (Sound.to_pitch_ac) of each file, 0 where unvoiced.
+        Files that are not stored yet are analysed in the process pool of the ParselmouthEngine.
+        :param voicing_threshold: a threshold, or a sequence of thresholds all served by one analysis of each file
+        :return: generator of f0 arrays at 1 / time_step frames per second (tuples of them, one per threshold,
+        if voicing_threshold is a sequence), in the same order as paths
+        """
+        thresholds = (voicing_threshold,) if np.isscalar(voicing_threshold) else tuple(voicing_threshold)
+        keys = [[self._key(p, 'pitch', time_step, f0_min, f0_max, th) for th in thresholds] for p in paths]
+        cached = [[self._get(key, 'f0') for key in file_keys] for file_keys in keys]
+        f0s = self.engine.to_pitch_ac(
+            (p for p, file_f0s in zip(paths, cached) if any(f0 is None for f0 in file_f0s)),
+            time_step=time_step,
+            voicing_threshold=voicing_threshold,
+            pitch_floor=f0_min,
+            pitch_ceiling=f0_max,
+        )
+        for file_keys, file_f0s in zip(keys, cached):
+            if any(f0 is None for f0 in file_f0s):
+                file_f0s = next(f0s)
+                if np.isscalar(voicing_threshold):
+                    file_f0s = (file_f0s,)
+                for key, f0 in zip(file_keys, file_f0s):
+                    self._put(key, 1. / time_step, f0=f0)
+            yield file_f0s[0] if np.isscalar(voicing_threshold) else tuple(file_f0s)
+
+    def spectral_centroid(self, path, time_step, sr=24000, n_fft=2048, regions=None):
+        """
+        librosa.feature.spectral_centroid of the file at sr, with frames every int(time_step * sr) samples.
+        :param regions: (begin, end) frame ranges to compute (the whole file if not specified); the other
+        frames are NaN. Frames computed once are kept in the entry, which grows as more regions are requested.
+        """
+        hop_size = int(time_step * sr)
+        key = self._key(path, 'spectral_centroid', hop_size, sr, n_fft, default_resampler())
+        cached = self.cache.get(key, ('centroid', 'computed')) if key is not None else None
+        if cached is not None:
+            centroid, computed = cached
+            wanted = region_mask(regions, computed.shape[0])
+            if not np.any(wanted & ~computed):
+                return centroid
+            centroid, computed = np.array(centroid), np.array(computed)
+        y, _ = load_audio(path, sr=sr, cache=self.audio_cache)
+        if cached is None:
+            n_frames = 1 + y.shape[0] // hop_size
+            centroid = np.full(n_frames, np.nan)
+            computed = np.zeros(n_frames, dtype=bool)
+            wanted = region_mask(regions, n_frames)
+        missing = wanted & ~computed
+        centroid[missing] = centroid_frames(np.asarray(y), np.flatnonzero(missing), sr, n_fft, hop_size)
+        computed |= missing
+        self._put(key, sr / hop_size, centroid=centroid, computed=computed)
+        return centroid
+
+    def summary(self) -> str:
+        return self.cache.summary() if self.cache is not None else 'disabled'
@@ -0,0 +1,147 @@
+import numpy as np
+import textgrid
+
+
+class IntervalTier:
+    """
+    An interval tier kept as arrays: the start and end times of the intervals, sorted and not overlapping,
+    and for each interval the index of its mark in a table of the distinct marks. Intervals are inserted,
+    deleted and merged in bulk, each batch rebuilding the arrays once, so that editing many intervals of
+    a long tier takes linear time. Tiers are converted from and to textgrid.IntervalTier only for I/O.
+    """
+
+    def __init__(self, name=None, min_times=(), max_times=(), marks=(), min_time=0., max_time=None):
+        self.name = name
+        self.min_time = min_time
+        self.max_time = max_time
+        self.min_times = np.array(min_times, dtype=np.float64)
+        self.max_times = np.array(max_times, dtype=np.float64)
+        self.table = []
+        self.table_index = {}
+        self.labels = self._intern(marks)
+        self._check()
+
+    @classmethod
+    def from_textgrid(cls, tier: textgrid.IntervalTier):
+        return cls(
+            name=tier.name,
+            min_times=[i.minTime for i in tier],
+            max_times=[i.maxTime for i in tier],
+            marks=[i.mark for i in tier],
+            min_time=tier.minTime,
+            max_time=tier.maxTime
+        )
+
+    def to_textgrid(self) -> textgrid.IntervalTier:
+        tier = textgrid.IntervalTier(name=self.name, minTime=self.min_time, maxTime=self.max_time)
+        tier.intervals = [
+            textgrid.Interval(min_time, max_time, mark)
+            for min_time, max_time, mark in zip(self.min_times.tolist(), self.max_times.tolist(), self.marks)
+        ]
+        return tier
+
+    def _intern(self, marks):
+        labels = np.empty(len(marks), dtype=np.int64)
+        for i, mark in enumerate(marks):
+            if mark not in self.table_index:
+                self.table_index[mark] = len(self.table)
+                self.table.append(mark)
+            labels[i] = self.table_index[mark]
+        return labels
+
+    def _check(self):
+        if not (self.min_times.shape == self.max_times.shape == self.labels.shape):
+            raise ValueError('Times and marks of the intervals do not match in length.')
+        if np.any(~(self.min_times < self.max_times)):
+            i = int(np.argmax(~(self.min_times < self.max_times)))
+            raise ValueError(self.min_times[i], self.max_times[i])
+        overlaps = self.max_times[:-1] > self.min_times[1:]
+        if np.any(overlaps):
+            i = int(np.argmax(overlaps))
+            raise ValueError(self[i], self[i + 1])
+
+    def __len__(self):
+        return self.labels.shape[0]
+
+    def __getitem__(self, i):
+        return float(self.min_times[i]), float(self.max_times[i]), self.table[self.labels[i]]
+
+    @property
+    def marks(self):
+        return [self.table[label] for label in self.labels.tolist()]
+
+    def durations(self):
+        return self.max_times - self.min_times
+
+    def where(self, *marks):
+        """
+        Mask of the intervals marked with any of marks.
+        """
+        ids = [self.table_index[mark] for mark in marks if mark in self.table_index]
+        return np.isin(self.labels, ids)
+
+    def set_marks(self, indices, mark):
+        self.labels[indices] = self._intern([mark])[0]
+
+    def insert(self, min_times, max_times, marks):
+        """
+        Insert intervals at once, keeping the tier sorted. Raises ValueError if any two overlap.
+        """
+        min_times = np.asarray(min_times, dtype=np.float64)
+        order = np.argsort(np.concatenate([self.min_times, min_times]), kind='stable')
+        self.min_times = np.concatenate([self.min_times, min_times])[order]
+        self.max_times = np.concatenate([self.max_times, np.asarray(max_times, dtype=np.float64)])[order]
+        self.labels = np.concatenate([self.labels, self._intern(marks)])[order]
+        self._check()
+
+    def delete(self, indices):
+        self.min_times = np.delete(self.min_times, indices)
+        self.max_times = np.delete(self.max_times, indices)
+        self.labels = np.delete(self.labels, indices)
+
+    def merge(self, indices, min_duration=None):
+        """
+        Remove the intervals at indices and give their time to their neighbours: split in the middle
+        between the neighbours on both sides, or all to the only neighbour at either end of the tier.
+        Intervals are merged in ascending order, each into the neighbours that remain at that point,
+        the same as removing them one by one. An interval without any neighbour is kept.
+        If min_duration is given, an interval that has grown to at least min_duration by the time it is
+        reached, from the time of an interval merged before it, is kept as well.
+        :return: the indices (before merging) of the intervals that were removed
+        """
+        keep = np.ones(len(self), dtype=bool)
+        prev = -1  # The nearest interval before the current one that is kept
+        for i in np.unique(np.asarray(indices, dtype=np.int64)).tolist():
+            if i > 0 and keep[i - 1]:
+                prev = i - 1
+            if min_duration is not None and self.max_times[i] - self.min_times[i] >= min_duration:
+                continue
+            next_ = i + 1 if i + 1 < len(self) else -1
+            if prev >= 0 and next_ >= 0:
+                self.max_times[prev] = self.min_times[next_] = (self.min_times[i] + self.max_times[i]) / 2
+            elif next_ >= 0:
+                self.min_times[next_] = self.min_times[i]
+            elif prev >= 0:
+                self.max_times[prev] = self.max_times[i]
+            else:
+                continue
+            keep[i] = False
+        merged = np.flatnonzero(~keep)
+        self.delete(merged)
+        return merged
+
+    def slice(self, min_time, max_time, name=None):
+        """
+        The parts of the intervals between min_time and max_time, as a new tier starting from 0.
+        """
+        begin = np.searchsorted(self.max_times, min_time, side='right')
+        end = np.searchsorted(self.min_times, max_time, side='left')
+        min_times = np.maximum(self.min_times[begin: end], min_time)
+        max_times = np.minimum(self.max_times[begin: end], max_time)
+        mask = min_times < max_times
+        return IntervalTier(
+            name=self.name if name is None else name,
+            min_times=min_times[mask] - min_time,
+            max_times=max_times[mask] - min_time,
+            marks=[self.table[label] for label in self.labels[begin: end][mask].tolist()]
+        )
@@ -0,0 +1,341 @@
+import itertools
+import math
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from fractions import Fraction
+
+import numpy as np
+import parselmouth as pm
+
+# log2(x) is computed as log(x) * NUMlog2e in Praat
+NUMLOG2E = 1.442695040888963407359924681001892137
+# Sound.to_pitch_ac analyses 3 periods of the pitch floor per frame
+PERIODS_PER_WINDOW = 3.
+
+
+def default_num_workers():
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count()
+
+
+def global_peak(values):
+    return np.abs(values - values.mean()).max() if values.shape[0] > 0 else 0.
+
+
+def path_finder(frequency, strength, intensity, time_step, silence_threshold=0.03, voicing_threshold=0.45,
+                octave_cost=0.01, octave_jump_cost=0.35, voiced_unvoiced_cost=0.14, ceiling=600., block_size=64):
+    """
+    Port of Pitch_pathFinder in Praat: choose the candidate of each frame along the most probable path.
+    :param frequency: [T, C] candidate frequencies (NaN for missing candidates, 0 for the unvoiced candidate)
+    :param strength: [T, C] candidate strengths
+    :param intensity: [T] local peak of each frame relative to the global peak of the sound
+    :return: [T] frequency of the chosen candidates (0 if unvoiced)
+    """
+    T, C = frequency.shape
+    valid = ~np.isnan(frequency)
+    frequency = np.where(valid, frequency, 0.)
+    voiced = (frequency > 0.) & (frequency < ceiling)
+    time_step_correction = 0.01 / time_step
+    octave_jump_cost *= time_step_correction
+    voiced_unvoiced_cost *= time_step_correction
+
+    if silence_threshold <= 0:
+        unvoiced_strength = np.zeros(T)
+    else:
+        unvoiced_strength = 2.0 - intensity / (silence_threshold / (1.0 + voicing_threshold))
+    unvoiced_strength = voicing_threshold + np.maximum(unvoiced_strength, 0.)
+    safe_frequency = np.where(voiced, frequency, ceiling)
+    delta = np.where(voiced, strength - octave_cost * (np.log(ceiling / safe_frequency) * NUMLOG2E),
+                     unvoiced_strength[:, None])
+    delta[~valid] = -np.inf
+
+    # Invalid candidates have a delta of -inf, so no path goes through them.
+    # Most frames have far fewer candidates than the array holds, so each block only spans the candidates in use.
+    width = C - np.argmax(valid[:, ::-1], axis=1)
+    psi = np.zeros((T, C), dtype=np.int64)
+    prev_delta = delta[0]
+    for start in range(1, T, block_size):
+        end = min(start + block_size, T)
+        n = width[start - 1: end].max()
+        columns = np.arange(n)
+        value = np.empty((n, n))
+        prev_delta = prev_delta[:n]
+        # Transition costs from every candidate of frame t - 1 to every candidate of frame t, [B, n, n]
+        f1 = safe_frequency[start - 1: end - 1, :n, None]
+        f2 = safe_frequency[start: end, None, :n]
+        v1 = voiced[start - 1: end - 1, :n, None]
+        v2 = voiced[start: end, None, :n]
+        cost = np.where(
+            v1 & v2, octave_jump_cost * np.abs(np.log(f1 / f2) * NUMLOG2E),
+            np.where(v1 | v2, voiced_unvoiced_cost, 0.)
+        )
+        for t in range(start, end):
+            np.subtract(prev_delta[:, None], cost[t - start], out=value)
+            np.add(value, delta[t, :n], out=value)
+            place = value.argmax(axis=0)
+            psi[t, :n] = place
+            prev_delta = value[place, columns]
+        if n < C:
+            prev_delta = np.concatenate([prev_delta, np.full(C - n, -np.inf)])
+
+    path = np.empty(T, dtype=np.int64)
+    path[-1] = np.argmax(prev_delta)
+    for t in range(T - 1, 0, -1):
+        path[t - 1] = psi[t, path[t]]
+    # Candidates above the ceiling count as unvoiced and tie with the unvoiced candidate, which Praat reports
+    frames = np.arange(T)
+    return np.where(voiced[frames, path], frequency[frames, path], 0.)
+
+
+def select_voicing(frequency, strength, voicing_threshold):
+    """
+    Praat only keeps voiced candidates stronger than half of the voicing threshold.
+    Mark the others as missing, to find the path at voicing_threshold from an analysis at a lower one.
+    """
+    return np.where((frequency > 0) & ~(strength > 0.5 * voicing_threshold), np.nan, frequency)
+
+
+def frame_samples(n_samples, sampling_frequency, time_step, pitch_floor):
+    """
+    The first sample (1-based) of the middle of each frame, with the same floating-point arithmetic as
+    Sampled_shortTermAnalysis and Sampled_xToLowIndex in Praat for a sound starting at time 0.
+    When a frame centre falls exactly between two samples, rounding decides which one is taken,
+    and that depends on the length of the sound and the index of the frame.
+    """
+    dx = 1. / sampling_frequency
+    duration = dx * n_samples
+    n_frames = math.floor((duration - PERIODS_PER_WINDOW / pitch_floor) / time_step) + 1
+    if n_frames < 1:
+        return np.zeros(0, dtype=np.int64)
+    x1 = 0.5 * dx
+    t1 = (x1 - 0.5 * dx + 0.5 * duration) - 0.5 * (n_frames * time_step) + 0.5 * time_step
+    t = t1 + np.arange(n_frames) * time_step
+    return np.floor((t - x1) / dx + 1.).astype(np.int64)
+
+
+def chunk_bounds(n_samples, sampling_frequency, time_step, pitch_floor, first_frame, last_frame, padding=1):
+    """
+    Find a range of samples [start, start + length) whose frames fall on the frame grid of the whole sound
+    and include frames [first_frame, last_frame), keeping padding samples on both sides for shifted runs.
+    Returns (start, length, offset) where offset is the index in the whole sound of the first frame of the chunk,
+    or None if there is no such range.
+    """
+    window = Fraction(PERIODS_PER_WINDOW / pitch_floor * sampling_frequency).limit_denominator(1000)
+    hop = Fraction(time_step * sampling_frequency).limit_denominator(1000)
+    n_frames = math.floor((n_samples - window) / hop) + 1
+    for margin in range(4):
+        for extra in range(4):
+            offset = first_frame - margin
+            count = last_frame - offset + extra
+            if offset < 0 or offset + count > n_frames:
+                continue
+            # The frames of the chunk are centred on the same frames of the whole sound:
+            # 2 * start + length = n_samples + (2 * offset + count - n_frames) * hop
+            total = n_samples + (2 * offset + count - n_frames) * hop
+            if total.denominator != 1:
+                continue
+            for length in range(math.ceil(window + (count - 1) * hop), math.ceil(window + count * hop)):
+                if (total - length) % 2 != 0:
+                    continue
+                start = int((total - length) / 2)
+                if start >= padding and start + length <= n_samples - padding:
+                    return start, length, offset
+    return None
+
+
+def widen(candidates, width):
+    """
+    Pad [T, C] candidate arrays to width columns with missing candidates (NaN, as Pitch.to_array marks them).
+    The number of candidates differs between analyses, e.g. 16 for silence and 4 for a clear tone.
+    """
+    if candidates.shape[1] >= width:
+        return candidates
+    return np.pad(candidates, ((0, 0), (0, width - candidates.shape[1])), constant_values=np.nan)
+
+
+def _analyse(values, sampling_frequency, params, candidates):
+    sound = pm.Sound(values, sampling_frequency=sampling_frequency)
+    pitch = sound.to_pitch_ac(**params)
+    if not candidates:
+        return pitch.selected_array['frequency']
+    array = pitch.to_array().T
+    # Relative to the global peak of the analysed values
+    intensity = np.array([pitch.get_frame(i + 1).intensity for i in range(pitch.n_frames)])
+    return pitch.selected_array['frequency'], array['frequency'], array['strength'], intensity, global_peak(values)
+
+
+def _load(sound):
+    if isinstance(sound, tuple):
+        values, sampling_frequency = sound
+        return np.asarray(values, dtype=np.float64), sampling_frequency
+    sound = pm.Sound(str(sound))
+    if sound.n_channels > 1:
+        sound = sound.convert_to_mono()
+    return sound.values[0], sound.sampling_frequency
+
+
+def _analyse_file(sound, params, candidates=False):
+    values, sampling_frequency = _load(sound)
+    return _analyse(values, sampling_frequency, params, candidates)
+
+
+class ParselmouthEngine:
+    """
+    Run parselmouth Sound.to_pitch_ac over many files in a pool of num_workers processes (all cores if 0).
+    Sounds longer than chunk_seconds are split into overlapping chunks that are analysed in parallel.
+    The pool is only started for work that gains from it, several sounds or a sound split into chunks;
+    a single short sound, or any sound with num_workers=1 (the default), is analysed in this process.
+    Each chunk is laid out so that its frames fall exactly on the frame grid of the whole sound, with
+    the analysis window (3 periods of the pitch floor) fully inside the chunk; the voicing path is then
+    chosen over all frames at once, so the result is the same as analysing the whole sound.
+    Several voicing thresholds can be served by one analysis, at the lowest of them.
+    """
+
+    def __init__(self, num_workers=1, chunk_seconds=60.):
+        self.num_workers = default_num_workers() if num_workers == 0 else num_workers
+        self.chunk_seconds = chunk_seconds
+        self.executor = None
+
+    def _submit(self, parallel, fn, *args):
+        if not parallel or self.num_workers <= 1:
+            return _Done(fn(*args))
+        if self.executor is None:
+            # Workers are spawned rather than forked: the pool may be started from a thread of a process that
+            # already runs other threads (e.g. the pitch daemon, or PyTorch), and forking those can deadlock
+            self.executor = ProcessPoolExecutor(self.num_workers, mp_context=multiprocessing.get_context('spawn'))
+        return self.executor.submit(fn, *args)
+
+    def to_pitch_ac(self, sounds, time_step, pitch_floor, pitch_ceiling, voicing_threshold=0.45,
+                    silence_threshold=0.03, octave_cost=0.01, octave_jump_cost=0.35, voiced_unvoiced_cost=0.14):
+        """
+        :param sounds: iterable of file paths or (values, sampling_frequency) tuples
+        :param voicing_threshold: a threshold, or a sequence of thresholds to get the pitch at each of them
+        from a single analysis of every sound
+        :return: generator of selected frequencies (0 if unvoiced), in the same order as sounds;
+        tuples of them, one per threshold, if voicing_threshold is a sequence
+        """
+        thresholds = None if np.isscalar(voicing_threshold) else tuple(voicing_threshold)
+        params = {
+            'time_step': time_step, 'pitch_floor': pitch_floor, 'pitch_ceiling': pitch_ceiling,
+            'voicing_threshold': voicing_threshold if thresholds is None else min(thresholds),
+            'silence_threshold': silence_threshold,
+            'octave_cost': octave_cost, 'octave_jump_cost': octave_jump_cost,
+            'voiced_unvoiced_cost': voiced_unvoiced_cost,
+        }
+        pending = deque()
+        sounds = iter(sounds)
+        head = list(itertools.islice(sounds, 2))
+        for sound in itertools.chain(head, sounds):
+            pending.append(self._schedule(sound, params, thresholds is not None, parallel=len(head) > 1))
+            # Keep a bounded number of files in flight
+            while len(pending) > 2 * self.num_workers:
+                yield self._collect(pending.popleft(), params, thresholds)
+        while pending:
+            yield self._collect(pending.popleft(), params, thresholds)
+
+    def _schedule(self, sound, params, candidates=False, parallel=True):
+        if self.num_workers <= 1 or self.chunk_seconds is None:
+            return None, [self._submit(parallel, _analyse_file, sound, params, candidates)]
+        values, sampling_frequency = _load(sound)
+        chunks = self._split(values.shape[0], sampling_frequency, params)
+        if chunks is None:
+            return None, [self._submit(parallel, _analyse, values, sampling_frequency, params, candidates)]
+        futures = []
+        for begin, end, runs in chunks:
+            futures.append([
+                (mask, self._submit(True, _analyse, values[start: start + length], sampling_frequency, params, True))
+                for start, length, mask in runs
+            ])
+        return ([(begin, end) for begin, end, _ in chunks], global_peak(values)), futures
+
+    def _split(self, n_samples, sampling_frequency, params):
+        time_step, pitch_floor = params['time_step'], params['pitch_floor']
+        samples = frame_samples(n_samples, sampling_frequency, time_step, pitch_floor)
+        n_frames = samples.shape[0]
+        chunk_frames = max(int(self.chunk_seconds / time_step), 1)
+        if n_frames <= 1.5 * chunk_frames:
+            return None
+        chunks = []
+        for first_frame in range(0, n_frames, chunk_frames):
+            last_frame = min(first_frame + chunk_frames, n_frames)
+            bounds = chunk_bounds(n_samples, sampling_frequency, time_step, pitch_floor, first_frame, last_frame)
+            if bounds is None:
+                return None
+            start, length, offset = bounds
+            begin, end = first_frame - offset, last_frame - offset
+            chunk_samples = frame_samples(length, sampling_frequency, time_step, pitch_floor)
+            if chunk_samples.shape[0] < end:
+                return None
+            # Frames that Praat rounds to another sample in the whole sound are taken from a shifted chunk
+            shifts = samples[first_frame: last_frame] - (chunk_samples[begin: end] + start)
+            if np.abs(shifts).max() > 1:
+                return None
+            runs = [(start + shift, length, shifts == shift) for shift in np.unique(shifts)]
+            chunks.append((begin, end, runs))
+        return chunks
+
+    def _collect(self, scheduled, params, thresholds=None):
+        chunks, futures = scheduled
+        if chunks is None:
+            if thresholds is None:
+                return futures[0].result()
+            # The path at the analysed threshold is chosen by Praat, the others from the same candidates
+            selected, frequency, strength, intensity, _ = futures[0].result()
+            return tuple(
+                selected if threshold == params['voicing_threshold']
+                else self._find_path(frequency, strength, intensity, params, threshold)
+                for threshold in thresholds
+            )
+        chunks, peak = chunks
+        frequency, strength, intensity = [], [], []
+        for (begin, end), runs in zip(chunks, futures):
+            for i, (mask, future) in enumerate(runs):
+                _, f, s, local_intensity, local_peak = future.result()
+                # Relative to the local peak instead of the global peak of this chunk
+                local_peak = local_intensity * local_peak
+                f, s, local_peak = f[begin: end], s[begin: end], local_peak[begin: end]
+                if i == 0:
+                    frequency.append(f)
+                    strength.append(s)
+                    intensity.append(local_peak)
+                else:
+                    width = max(frequency[-1].shape[1], f.shape[1])
+                    frequency[-1], strength[-1] = widen(frequency[-1], width), widen(strength[-1], width)
+                    frequency[-1][mask] = widen(f, width)[mask]
+                    strength[-1][mask] = widen(s, width)[mask]
+                    intensity[-1][mask] = local_peak[mask]
+        width = max(f.shape[1] for f in frequency)
+        frequency = np.concatenate([widen(f, width) for f in frequency])
+        strength = np.concatenate([widen(s, width) for s in strength])
+        intensity = np.concatenate(intensity)
+        intensity = np.minimum(intensity / peak, 1.) if peak > 0 else np.ones_like(intensity)
+        if thresholds is None:
+            return self._find_path(frequency, strength, intensity, params, params['voicing_threshold'])
+        return tuple(self._find_path(frequency, strength, intensity, params, threshold) for threshold in thresholds)
+
+    @staticmethod
+    def _find_path(frequency, strength, intensity, params, voicing_threshold):
+        if voicing_threshold != params['voicing_threshold']:
+            frequency = select_voicing(frequency, strength, voicing_threshold)
+        return path_finder(
+            frequency, strength, intensity, params['time_step'],
+            silence_threshold=params['silence_threshold'], voicing_threshold=voicing_threshold,
+            octave_cost=params['octave_cost'], octave_jump_cost=params['octave_jump_cost'],
+            voiced_unvoiced_cost=params['voiced_unvoiced_cost'], ceiling=params['pitch_ceiling']
+        )
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+
+class _Done:
+    def __init__(self, value):
+        self.value = value
+
+    def result(self):
+        return self.value
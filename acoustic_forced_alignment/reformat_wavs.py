@@ -2,11 +2,12 @@ import pathlib
 import shutil
 
 import click
-import librosa
 import numpy as np
 import soundfile
 import tqdm
 
+import resampler
+
 
 @click.command(help='Reformat the WAV files to 16kHz, 16bit PCM mono format and copy labels')
 @click.option('--src', required=True, help='Source segments directory')
@@ -28,11 +29,11 @@ def reformat_wavs(src, dst, normalize):
     if normalize:
         max_y = 0.0
         for file in tqdm.tqdm(filelist):
-            y, _ = librosa.load(file, sr=samplerate, mono=True)
+            y, _ = resampler.load(file, sr=samplerate, mono=True)
             max_y = max(max_y, np.max(np.abs(y)))
         max_y += 0.01
     for file in tqdm.tqdm(filelist):
-        y, _ = librosa.load(file, sr=samplerate, mono=True)
+        y, _ = resampler.load(file, sr=samplerate, mono=True)
         soundfile.write((dst / file.name), y / max_y, samplerate, subtype='PCM_16')
         annotation = file.with_suffix('.lab')
         shutil.copy(annotation, dst)
@@ -0,0 +1,65 @@
+import functools
+import math
+import os
+
+import librosa
+import numpy as np
+
+# Polyphase filters: (half length in multiples of the larger rate factor, Kaiser beta, cutoff relative to Nyquist)
+POLYPHASE_FILTERS = {
+    'polyphase': (10, 5.0, 1.0),
+    'polyphase_hq': (32, 10.0, 0.95),
+}
+# Backends of librosa.resample
+LIBROSA_RESAMPLERS = ('kaiser_best', 'kaiser_fast', 'soxr_vhq', 'soxr_hq', 'soxr_mq', 'soxr_lq')
+RESAMPLERS = tuple(POLYPHASE_FILTERS) + LIBROSA_RESAMPLERS
+DEFAULT_RESAMPLER = 'kaiser_best'
+
+
+def default_resampler():
+    # One setting for all tools of the project, e.g. MAKEDIFFSINGER_RESAMPLER=polyphase_hq
+    res_type = os.environ.get('MAKEDIFFSINGER_RESAMPLER', DEFAULT_RESAMPLER)
+    if res_type not in RESAMPLERS:
+        raise ValueError(f'Unknown resampler: {res_type} (choose from {", ".join(RESAMPLERS)})')
+    return res_type
+
+
+@functools.lru_cache(maxsize=None)
+def polyphase_filter(up, down, res_type='polyphase'):
+    # Designed once per rate pair and quality
+    import scipy.signal
+    half_length, beta, cutoff = POLYPHASE_FILTERS[res_type]
+    max_rate = max(up, down)
+    return scipy.signal.firwin(
+        2 * half_length * max_rate + 1, cutoff / max_rate, window=('kaiser', beta)
+    )
+
+
+def resample(y, orig_sr, target_sr, res_type=None):
+    """
+    Resample y (time on the last axis) from orig_sr to target_sr with the given backend
+    (the project-wide default if not specified).
+    """
+    if res_type is None:
+        res_type = default_resampler()
+    if orig_sr == target_sr:
+        return y
+    if res_type in POLYPHASE_FILTERS:
+        import scipy.signal
+        gcd = math.gcd(int(orig_sr), int(target_sr))
+        up, down = int(target_sr) // gcd, int(orig_sr) // gcd
+        y_hat = scipy.signal.resample_poly(y, up, down, axis=-1, window=polyphase_filter(up, down, res_type))
+        # Same length as librosa.resample
+        n_samples = int(math.ceil(y.shape[-1] * target_sr / orig_sr))
+        return np.ascontiguousarray(y_hat[..., :n_samples], dtype=y.dtype)
+    return librosa.resample(y, orig_sr=orig_sr, target_sr=target_sr, res_type=res_type)
+
+
+def load(path, sr=22050, mono=True, res_type=None):
+    """
+    librosa.load with the resampling backend chosen by res_type (the project-wide default if not specified).
+    """
+    y, sr_native = librosa.load(path, sr=None, mono=mono)
+    if sr is None:
+        return y, sr_native
+    return resample(y, sr_native, sr, res_type=res_type), sr
@@ -6,6 +6,8 @@ import soundfile
 import textgrid
 import tqdm
 
+from interval_tier import IntervalTier
+
 
 @click.command(help='Slice 3-tier TextGrids and long recordings into segmented 2-tier TextGrids and wavs')
 @click.option(
@@ -47,33 +49,15 @@ def slice_tg(wavs, tg, out, preserve_sentence_names, digits, wav_subtype, overwr
         tg.read(tg_file)
         wav, sr = librosa.load((wav_path_in / tg_file.name).with_suffix('.wav'), sr=None)
         sentences_tier = tg[0]
-        words_tier = tg[1]
-        phones_tier = tg[2]
+        words_tier = IntervalTier.from_textgrid(tg[1])
+        phones_tier = IntervalTier.from_textgrid(tg[2])
         idx = 0
         for sentence in sentences_tier:
             if sentence.mark == '':
                 continue
             sentence_tg = textgrid.TextGrid()
-            sentence_words_tier = textgrid.IntervalTier(name='words')
-            sentence_phones_tier = textgrid.IntervalTier(name='phones')
-            for word in words_tier:
-                min_time = max(sentence.minTime, word.minTime)
-                max_time = min(sentence.maxTime, word.maxTime)
-                if min_time >= max_time:
-                    continue
-                sentence_words_tier.add(
-                    minTime=min_time - sentence.minTime, maxTime=max_time - sentence.minTime, mark=word.mark
-                )
-            for phone in phones_tier:
-                min_time = max(sentence.minTime, phone.minTime)
-                max_time = min(sentence.maxTime, phone.maxTime)
-                if min_time >= max_time:
-                    continue
-                sentence_phones_tier.add(
-                    minTime=min_time - sentence.minTime, maxTime=max_time - sentence.minTime, mark=phone.mark
-                )
-            sentence_tg.append(sentence_words_tier)
-            sentence_tg.append(sentence_phones_tier)
+            sentence_tg.append(words_tier.slice(sentence.minTime, sentence.maxTime, name='words').to_textgrid())
+            sentence_tg.append(phones_tier.slice(sentence.minTime, sentence.maxTime, name='phones').to_textgrid())
 
             if preserve_sentence_names:
                 tg_file_out = sliced_path_out / f'{sentence.mark}.TextGrid'
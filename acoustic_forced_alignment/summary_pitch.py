@@ -4,17 +4,38 @@ import click
 import librosa
 import matplotlib.pyplot as plt
 import numpy as np
-import parselmouth as pm
 import tqdm
 from textgrid import TextGrid
 
 import distribution
+from feature_store import FeatureStore
+
+
+def iter_pitch_yin(filelist, time_step, f0_min, f0_max, chunk_size=64):
+    # Files are analysed a chunk at a time, in one batch per sample rate
+    from yin import yin_batch
+    for i in range(0, len(filelist), chunk_size):
+        waveforms = [librosa.load(wavfile, sr=None, mono=True) for wavfile in filelist[i: i + chunk_size]]
+        f0s = [None] * len(waveforms)
+        for sr in set(sr for _, sr in waveforms):
+            indices = [j for j, (_, sr_) in enumerate(waveforms) if sr_ == sr]
+            batch = yin_batch(
+                [waveforms[j][0] for j in indices], sr, time_step * sr, f0_min=f0_min, f0_max=f0_max
+            )
+            for j, f0 in zip(indices, batch):
+                f0s[j] = f0
+        yield from f0s
 
 
 @click.command(help='Generate word-level pitch summary')
 @click.option('--wavs', required=True, help='Path to the segments directory')
 @click.option('--tg', required=True, help='Path to the TextGrids directory')
-def summary_pitch(wavs, tg):
+@click.option('--pe', type=click.Choice(['parselmouth', 'yin']), default='parselmouth', show_default=True,
+              help='Pitch extractor')
+@click.option('--workers', type=int, default=1, show_default=True,
+              help='Number of processes for pitch extraction (0 for all cores)')
+@click.option('--cache_dir', help='Directory to cache extracted pitch across runs')
+def summary_pitch(wavs, tg, pe, workers, cache_dir):
     wavs = pathlib.Path(wavs)
     tg_dir = pathlib.Path(tg)
     del tg
@@ -24,16 +45,16 @@ def summary_pitch(wavs, tg):
     f0_min = 40.
     f0_max = 1100.
     voicing_thresh_vowel = 0.45
-    for wavfile in tqdm.tqdm(filelist):
+    timestep = 0.01
+    if pe == 'yin':
+        f0s = iter_pitch_yin(filelist, timestep, f0_min, f0_max)
+    else:
+        f0s = FeatureStore(cache_dir, num_workers=workers).pitch(
+            filelist, timestep, f0_min, f0_max, voicing_threshold=voicing_thresh_vowel
+        )
+    for wavfile, f0 in tqdm.tqdm(zip(filelist, f0s), total=len(filelist)):
         tg = TextGrid()
         tg.read(tg_dir / wavfile.with_suffix('.TextGrid').name)
-        timestep = 0.01
-        f0 = pm.Sound(str(wavfile)).to_pitch_ac(
-            time_step=timestep,
-            voicing_threshold=voicing_thresh_vowel,
-            pitch_floor=f0_min,
-            pitch_ceiling=f0_max,
-        ).selected_array['frequency']
         pitch = 12. * np.log2(f0 / 440.) + 69.
         for word in tg[0]:
             if word.mark in ['AP', 'SP']:
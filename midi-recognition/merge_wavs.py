@@ -4,10 +4,11 @@ import pathlib
 from collections import OrderedDict
 
 import click
-import librosa
 import numpy as np
 import soundfile
 
+import resampler
+
 
 @click.command(help='Merge clips into segments of similar length')
 @click.argument('input_wavs', metavar='INPUT_WAVS')
@@ -51,7 +52,7 @@ def merge_wavs(
     for wav in tqdm.tqdm(input_wavs.iterdir()):
         if not wav.is_file() or wav.suffix != '.wav':
             continue
-        y, _ = librosa.load(wav, sr=sr, mono=True)
+        y, _ = resampler.load(wav, sr=sr, mono=True)
         cur_len = y.shape[0] / sr
         if len(cache) > 0 and cache_len + cur_len >= length:
             save_cache()
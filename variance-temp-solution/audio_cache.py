@@ -0,0 +1,103 @@
+import math
+import pathlib
+
+import librosa
+import numpy as np
+import soundfile
+
+import resampler
+from disk_cache import DiskCache, hash_file, make_key
+
+
+class AudioCache:
+    """
+    Decode each audio file once and serve it at any sample rate from a DiskCache.
+    Waveforms are keyed by the content hash of the file, the sample rate and the resampler, and are loaded
+    memory-mapped (copy-on-write, so they can be modified in place without touching the cache).
+    Resampled waveforms are the same as resampler.load(path, sr=sr, res_type=res_type) returns.
+    New waveforms are not stored if reserve() finds that the corpus being processed does not fit in max_size.
+    """
+
+    def __init__(self, cache_dir, max_size=4 << 30):
+        # Shares the directory given by --cache_dir with the pitch cache, in a subdirectory of its own
+        self.cache = DiskCache(pathlib.Path(cache_dir) / 'audio', max_size=max_size)
+        self.native_rates = {}
+        self.store = True
+
+    def _native_rate(self, path, file_hash):
+        if file_hash not in self.native_rates:
+            try:
+                self.native_rates[file_hash] = soundfile.info(str(path)).samplerate
+            except RuntimeError:
+                # Not readable by soundfile; known once the file is decoded by librosa
+                return None
+        return self.native_rates[file_hash]
+
+    def reserve(self, paths, sample_rates=()):
+        """
+        Check whether the waveforms of all paths, decoded at their native sample rate and resampled to each of
+        sample_rates, fit in the size limit. If not, new waveforms are not stored during this run: a corpus larger
+        than the cache would evict each of its entries before it is read again.
+        :return: whether new waveforms are stored
+        """
+        size = 0
+        for path in paths:
+            try:
+                info = soundfile.info(str(path))
+            except RuntimeError:
+                continue
+            rates = {info.samplerate, *(sr for sr in sample_rates if sr is not None)}
+            # float32 samples, and the header of each .npy file
+            size += sum(math.ceil(info.frames * sr / info.samplerate) * 4 + 256 for sr in rates)
+        self.store = size <= self.cache.max_size
+        if not self.store:
+            print(f'Warning: the decoded audio of these files ({size / (1 << 20):.1f} MiB) does not fit in '
+                  f'the audio cache ({self.cache.max_size / (1 << 20):.1f} MiB) and is not cached; '
+                  f'raise --audio_cache_size to cache it.')
+        return self.store
+
+    def _get(self, file_hash, sr, res_type=None):
+        cached = self.cache.get(make_key('audio', file_hash, sr, res_type), ('y', 'sr'), mmap_mode='c')
+        if cached is None:
+            return None
+        y, sr_ = cached
+        return y, int(sr_[0])
+
+    def load(self, path, sr=None, res_type=None):
+        """
+        :param sr: target sample rate, or None for the native sample rate of the file
+        :param res_type: resampler (the project-wide default if not specified)
+        :return: (y, sr) like librosa.load
+        """
+        if res_type is None:
+            res_type = resampler.default_resampler()
+        file_hash = hash_file(path)
+        if sr is not None and sr == self._native_rate(path, file_hash):
+            # The native decode is stored without a sample rate in its key
+            sr = None
+        if sr is not None:
+            cached = self._get(file_hash, sr, res_type)
+            if cached is not None:
+                return cached
+        native = self._get(file_hash, None)
+        if native is None:
+            y, sr_native = librosa.load(path, sr=None, mono=True)
+            if self.store:
+                self.cache.put(make_key('audio', file_hash, None, None), y=y, sr=np.array([sr_native]))
+        else:
+            y, sr_native = native
+        self.native_rates[file_hash] = sr_native
+        if sr is not None and sr != sr_native:
+            y = resampler.resample(np.asarray(y), sr_native, sr, res_type=res_type)
+            if self.store:
+                self.cache.put(make_key('audio', file_hash, sr, res_type), y=y, sr=np.array([sr]))
+        return y, sr if sr is not None else sr_native
+
+    def summary(self) -> str:
+        return self.cache.summary()
+
+
+def load_audio(path, sr=None, cache: AudioCache = None, res_type=None):
+    if cache is None:
+        return resampler.load(path, sr=sr, mono=True, res_type=res_type)
+    return cache.load(path, sr=sr, res_type=res_type)
@@ -0,0 +1,216 @@
+import json
+import multiprocessing
+import pathlib
+import platform
+import queue as queue_module
+import resource
+import subprocess
+import time
+
+import click
+import numpy as np
+
+SAMPLE_RATE = 44100
+HOP_SIZE = 512
+SIGNALS = ('sweep', 'vibrato', 'noise', 'silence')
+DEFAULT_DURATIONS = (1., 10., 60., 600., 1800.)
+ASSET_WAV = pathlib.Path(__file__).parent.parent / 'acoustic_forced_alignment' / 'assets' / '2001000001.wav'
+
+
+def sweep_f0(t):
+    # Exponential sweeps from 110 Hz to 880 Hz, restarting every 8 seconds
+    return 110 * 2 ** (3 * (t % 8.) / 8.)
+
+
+def vibrato_f0(t):
+    # 330 Hz with +-50 cents of vibrato at 5.5 Hz
+    return 330 * 2 ** (0.5 / 12 * np.sin(2 * np.pi * 5.5 * t))
+
+
+F0_CURVES = {'sweep': sweep_f0, 'vibrato': vibrato_f0}
+
+
+def make_signal(kind, seconds, sr=SAMPLE_RATE, hop_size=HOP_SIZE, block_seconds=10.):
+    """
+    Generate a test signal with its ground truth f0 at the frame times of get_pitch (0 where unvoiced).
+    Voiced signals are harmonic tones; they are synthesized in blocks to keep long signals in float32.
+    :return: waveform, f0
+    """
+    n_samples = int(seconds * sr)
+    n_frames = (n_samples + hop_size - 1) // hop_size
+    if kind == 'silence':
+        return np.zeros(n_samples, dtype=np.float32), np.zeros(n_frames)
+    if kind == 'noise':
+        rng = np.random.default_rng(0)
+        return (rng.standard_normal(n_samples) * 0.1).astype(np.float32), np.zeros(n_frames)
+    curve = F0_CURVES[kind]
+    waveform = np.empty(n_samples, dtype=np.float32)
+    block = int(block_seconds * sr)
+    phase = 0.
+    for start in range(0, n_samples, block):
+        f0 = curve(np.arange(start, min(start + block, n_samples)) / sr)
+        phases = phase + 2 * np.pi * np.cumsum(f0) / sr
+        phase = phases[-1]
+        waveform[start: start + f0.shape[0]] = sum(
+            np.sin(k * phases) / k * (k * f0 < sr / 2)
+            for k in range(1, 11)
+        ) * 0.3
+    return waveform, curve(np.arange(n_frames) * hop_size / sr)
+
+
+def accuracy(f0_ref, f0_est):
+    # Cents error on frames voiced in both, and the fraction of frames with a wrong voicing decision
+    n = min(f0_ref.shape[0], f0_est.shape[0])
+    f0_ref, f0_est = f0_ref[:n], f0_est[:n]
+    voiced = (f0_ref > 0) & (f0_est > 0)
+    cents = np.abs(1200 * np.log2(f0_est[voiced] / f0_ref[voiced]))
+    return {
+        'mean_cents': float(np.mean(cents)) if cents.shape[0] > 0 else None,
+        'p95_cents': float(np.percentile(cents, 95)) if cents.shape[0] > 0 else None,
+        'gross_error': float(np.mean(cents > 50)) if cents.shape[0] > 0 else None,
+        'voicing_error': float(np.mean((f0_ref > 0) != (f0_est > 0))),
+    }
+
+
+def reset_peak_rss():
+    # Linux resets the peak resident set size of the process when 5 is written to clear_refs
+    try:
+        with open('/proc/self/clear_refs', 'w', encoding='utf8') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss():
+    # Peak resident set size in MiB since reset_peak_rss(), or since the process started if it cannot be reset
+    try:
+        with open('/proc/self/status', encoding='utf8') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_backend(algorithm, durations, signals, asset):
+    """
+    Benchmark one backend. This runs in a fresh process, so the start-up cost and the memory are its own.
+    The peak memory of each run is measured from the start of the run where the platform allows it
+    (per_run_rss in the report), and is otherwise the peak of the process so far.
+    """
+    start = time.perf_counter()
+    from get_pitch import get_pitch
+    waveform, _ = make_signal('vibrato', 1.)
+    get_pitch(algorithm, waveform, HOP_SIZE, SAMPLE_RATE, interp_uv=False)
+    report = {'cold_start': time.perf_counter() - start, 'base_rss_mb': peak_rss(), 'runs': []}
+    items = [(kind, seconds) for seconds in sorted(durations) for kind in signals]
+    if asset is not None:
+        items.append(('asset', None))
+    for kind, seconds in items:
+        if kind == 'asset':
+            import librosa
+            waveform, _ = librosa.load(asset, sr=SAMPLE_RATE, mono=True)
+            f0_ref = None
+            seconds = waveform.shape[0] / SAMPLE_RATE
+        else:
+            waveform, f0_ref = make_signal(kind, seconds)
+        report['per_run_rss'] = reset_peak_rss()
+        start = time.perf_counter()
+        _, f0, uv = get_pitch(algorithm, waveform, HOP_SIZE, SAMPLE_RATE, interp_uv=False)
+        elapsed = time.perf_counter() - start
+        run = {
+            'signal': kind, 'seconds': seconds, 'time': elapsed, 'rtf': elapsed / seconds,
+            'peak_rss_mb': peak_rss(), 'voiced_ratio': float(np.mean(~uv)),
+        }
+        if f0_ref is not None:
+            run.update(accuracy(f0_ref, f0))
+        report['runs'].append(run)
+        del waveform
+    return report
+
+
+def _worker(queue, *args):
+    try:
+        queue.put(run_backend(*args))
+    except Exception as e:
+        queue.put({'error': f'{type(e).__name__}: {e}'})
+
+
+def collect(queue, process):
+    # The report of the worker, or an error as soon as it dies without one (e.g. killed when out of memory)
+    while True:
+        try:
+            return queue.get(timeout=1.)
+        except queue_module.Empty:
+            if process.exitcode is not None:
+                try:
+                    return queue.get(timeout=1.)
+                except queue_module.Empty:
+                    return {'error': f'the process exited with code {process.exitcode}'}
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=pathlib.Path(__file__).parent, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@click.command(help='Measure speed, memory and accuracy of the pitch extractors on generated signals')
+@click.option('--pe', 'algorithms', metavar='ALGORITHM', multiple=True,
+              help='Pitch extractors to benchmark (all if not specified)')
+@click.option('--durations', metavar='SECONDS', default=','.join(f'{d:g}' for d in DEFAULT_DURATIONS),
+              show_default=True, help='Comma-separated lengths of the generated signals in seconds')
+@click.option('--signal', 'signals', type=click.Choice(SIGNALS), multiple=True,
+              help='Generated signals to use (all if not specified)')
+@click.option('--wav', metavar='WAV', default=str(ASSET_WAV), show_default=True,
+              help='Recording to benchmark in addition (without ground truth); empty to skip')
+@click.option('--out', metavar='FILE', help='Path to save the report as JSON')
+def benchmark_pitch(algorithms, durations, signals, wav, out):
+    from get_pitch import PITCH_ALGORITHMS
+
+    algorithms = algorithms or PITCH_ALGORITHMS
+    durations = [float(d) for d in durations.split(',')]
+    signals = signals or SIGNALS
+    report = {
+        'commit': git_commit(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'cpus': multiprocessing.cpu_count(),
+        'sample_rate': SAMPLE_RATE,
+        'hop_size': HOP_SIZE,
+        'backends': {},
+    }
+    context = multiprocessing.get_context('spawn')
+    print(f'{"backend":<18}{"signal":>8}{"seconds":>9}{"RTF":>9}{"peak RSS":>11}'
+          f'{"mean cents":>12}{"p95 cents":>11}{"voicing err":>13}')
+    for algorithm in algorithms:
+        queue = context.Queue()
+        process = context.Process(target=_worker, args=(queue, algorithm, durations, signals, wav or None))
+        process.start()
+        result = collect(queue, process)
+        process.join()
+        report['backends'][algorithm] = result
+        if 'error' in result:
+            print(f'{algorithm:<18}  not available ({result["error"]})')
+            continue
+        print(f'{algorithm:<18}{"cold start":>17}{result["cold_start"]:>8.2f}s{result["base_rss_mb"]:>8.0f}MiB')
+        for run in result['runs']:
+            cents = f'{run["mean_cents"]:>12.2f}{run["p95_cents"]:>11.2f}' \
+                if run.get('mean_cents') is not None else f'{"-":>12}{"-":>11}'
+            voicing = f'{run["voicing_error"]:>13.2%}' if 'voicing_error' in run else f'{"-":>13}'
+            print(f'{"":<18}{run["signal"]:>8}{run["seconds"]:>9.0f}{run["rtf"]:>9.4f}'
+                  f'{run["peak_rss_mb"]:>8.0f}MiB{cents}{voicing}')
+    if out is not None:
+        with open(out, 'w', encoding='utf8') as f:
+            json.dump(report, f, indent=2)
+        print(f'Report saved to {out}')
+
+
+if __name__ == '__main__':
+    benchmark_pitch()
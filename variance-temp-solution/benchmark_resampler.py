@@ -0,0 +1,68 @@
+import time
+
+import click
+import numpy as np
+
+RATE_PAIRS = ((48000, 44100), (44100, 24000), (44100, 16000))
+
+
+def tone(freq, sr, seconds):
+    t = np.arange(int(sr * seconds)) / sr
+    return np.sin(2 * np.pi * freq * t)
+
+
+def passband_snr(res_type, orig_sr, target_sr, seconds=1.):
+    # Worst error against ideal sines up to 80% of the target Nyquist frequency, in dB
+    from resampler import resample
+    margin = int(0.1 * target_sr)
+    snrs = []
+    for freq in np.linspace(100., 0.4 * target_sr, 8):
+        y = resample(tone(freq, orig_sr, seconds).astype(np.float32), orig_sr, target_sr, res_type=res_type)
+        ref = tone(freq, target_sr, seconds)
+        n = min(y.shape[0], ref.shape[0])
+        err = y[margin: n - margin] - ref[margin: n - margin]
+        snrs.append(10 * np.log10(np.mean(ref[margin: n - margin] ** 2) / max(np.mean(err ** 2), 1e-30)))
+    return min(snrs)
+
+
+def aliasing(res_type, orig_sr, target_sr, seconds=1.):
+    # Worst level of sines from 110% of the target Nyquist frequency after resampling, in dB;
+    # None if there are no such frequencies below 98% of the input Nyquist frequency (e.g. 48 kHz -> 44.1 kHz)
+    from resampler import resample
+    low, high = 0.55 * target_sr, 0.49 * orig_sr
+    if low >= high:
+        return None
+    margin = int(0.1 * target_sr)
+    levels = []
+    for freq in np.linspace(low, high, 8):
+        y = resample(tone(freq, orig_sr, seconds).astype(np.float32), orig_sr, target_sr, res_type=res_type)
+        levels.append(10 * np.log10(max(np.mean(y[margin: -margin] ** 2) / 0.5, 1e-30)))
+    return max(levels)
+
+
+@click.command(help='Compare throughput and aliasing of the resampling backends')
+@click.option('--seconds', metavar='SECONDS', type=float, default=30., show_default=True,
+              help='Length of the noise used to measure throughput')
+def benchmark_resampler(seconds):
+    from resampler import RESAMPLERS, resample
+
+    print(f'{"rates":>14}{"backend":>14}{"x realtime":>12}{"passband SNR":>14}{"aliasing":>10}')
+    for orig_sr, target_sr in RATE_PAIRS:
+        noise = np.random.default_rng(0).standard_normal(int(orig_sr * seconds)).astype(np.float32)
+        for res_type in RESAMPLERS:
+            try:
+                resample(noise[:orig_sr], orig_sr, target_sr, res_type=res_type)  # warm up and design filters
+            except Exception as e:
+                print(f'{orig_sr:>6} -> {target_sr:>5}{res_type:>14}  not available ({type(e).__name__})')
+                continue
+            start = time.perf_counter()
+            resample(noise, orig_sr, target_sr, res_type=res_type)
+            speed = seconds / (time.perf_counter() - start)
+            snr = passband_snr(res_type, orig_sr, target_sr)
+            alias = aliasing(res_type, orig_sr, target_sr)
+            alias = f'{alias:>8.1f}dB' if alias is not None else f'{"-":>10}'
+            print(f'{orig_sr:>6} -> {target_sr:>5}{res_type:>14}{speed:>12.1f}{snr:>12.1f}dB{alias}')
+
+
+if __name__ == '__main__':
+    benchmark_resampler()
@@ -0,0 +1,81 @@
+import time
+import tracemalloc
+
+import click
+import numpy as np
+
+
+def dense_local_average_f0(hidden, thred=0.03):
+    # The previous decoder, which masks all bins of every frame, kept as the reference
+    from rmvpe.constants import CONST, N_CLASS
+    idx = np.arange(N_CLASS)[None, None, :]
+    idx_cents = (idx * 20 + CONST).astype(np.float32)
+    center = np.argmax(hidden, axis=2)[:, :, None]
+    start = np.clip(center - 4, a_min=0, a_max=None)
+    end = np.clip(center + 5, a_min=None, a_max=N_CLASS)
+    weights = hidden * ((idx >= start) & (idx < end))
+    product_sum = np.sum(weights * idx_cents, axis=2)
+    weight_sum = np.sum(weights, axis=2)
+    cents = product_sum / (weight_sum + (weight_sum == 0))
+    f0 = 10 * 2 ** (cents / 1200)
+    f0 = f0 * ~(hidden.max(axis=2) < thred)
+    return f0.squeeze(0)
+
+
+def make_salience(n_frames, seed=0):
+    """
+    Salience like the output of RMVPE: a peak of a few bins around a wandering pitch, low noise elsewhere,
+    and unvoiced stretches where every bin is low.
+    """
+    from rmvpe.constants import N_CLASS
+    rng = np.random.default_rng(seed)
+    center = 180 + 120 * np.sin(np.arange(n_frames) / 700) + rng.normal(0, 2, n_frames)
+    bins = np.arange(N_CLASS, dtype=np.float32)
+    hidden = rng.uniform(0, 0.02, (1, n_frames, N_CLASS)).astype(np.float32)
+    for start in range(0, n_frames, 4096):
+        c = center[start: start + 4096, None].astype(np.float32)
+        hidden[0, start: start + 4096] += 0.9 * np.exp(-0.5 * ((bins - c) / 1.5) ** 2)
+    unvoiced = (np.arange(n_frames) // 300) % 5 == 0
+    hidden[0, unvoiced] *= 0.01
+    return hidden
+
+
+def measure(fn, *args, repeat=3):
+    # Best wall time over repeat runs, and the peak of memory allocated while running (besides the result)
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    del result
+    tracemalloc.start()
+    result = fn(*args)
+    peak = tracemalloc.get_traced_memory()[1] - result.nbytes
+    tracemalloc.stop()
+    return result, best, peak
+
+
+@click.command(help='Measure latency and peak temporary memory of RMVPE local-average f0 decoding')
+@click.option('--minutes', metavar='MINUTES', type=float, default=10., show_default=True,
+              help='Length of the salience to decode in minutes (100 frames per second)')
+@click.option('--repeat', metavar='N', type=int, default=3, show_default=True, help='Number of timed runs')
+def benchmark_rmvpe_decode(minutes, repeat):
+    from rmvpe.utils import to_local_average_f0
+
+    hidden = make_salience(int(minutes * 60 * 100))
+    print(f'Salience: {hidden.shape[1]} frames x {hidden.shape[2]} bins ({hidden.nbytes / (1 << 20):.0f} MiB)')
+    print(f'{"decoder":<10}{"time":>10}{"peak temporaries":>19}')
+    ref_f0, ref_time, ref_peak = measure(dense_local_average_f0, hidden, repeat=repeat)
+    print(f'{"dense":<10}{ref_time * 1000:>8.0f}ms{ref_peak / (1 << 20):>15.1f}MiB')
+    f0, elapsed, peak = measure(to_local_average_f0, hidden[0], repeat=repeat)
+    print(f'{"gathered":<10}{elapsed * 1000:>8.0f}ms{peak / (1 << 20):>15.1f}MiB')
+    voiced = (ref_f0 > 0) & (f0 > 0)
+    cents = np.abs(1200 * np.log2(f0[voiced] / ref_f0[voiced]))
+    print(f'Speedup {ref_time / elapsed:.1f}x, '
+          f'max deviation {cents.max() if cents.shape[0] > 0 else 0.:.4f} cents, '
+          f'voicing {"identical" if np.array_equal(ref_f0 > 0, f0 > 0) else "different"}')
+
+
+if __name__ == '__main__':
+    benchmark_rmvpe_decode()
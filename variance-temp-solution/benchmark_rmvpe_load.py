@@ -0,0 +1,89 @@
+import multiprocessing
+import pathlib
+import queue as queue_module
+import time
+
+import click
+
+MODEL_DIR = pathlib.Path(__file__).parent / 'assets' / 'rmvpe'
+
+
+def memory_usage():
+    # RSS, PSS and private dirty memory in MiB from /proc (Linux only)
+    usage = {}
+    try:
+        with open('/proc/self/smaps_rollup', encoding='utf8') as f:
+            for line in f:
+                name, _, value = line.partition(':')
+                if name in ('Rss', 'Pss', 'Private_Dirty'):
+                    usage[name.lower()] = int(value.split()[0]) / 1024
+    except OSError:
+        pass
+    return usage
+
+
+def _worker(model_path, barrier, queue):
+    import torch
+    torch.set_num_threads(1)
+    start = time.perf_counter()
+    from rmvpe import RMVPE
+    from rmvpe.utils import make_calibration_audio
+    imported = time.perf_counter()
+    rmvpe = RMVPE(model_path)
+    loaded = time.perf_counter()
+    rmvpe.infer_from_audio(make_calibration_audio(seconds=1.))
+    # Measure once every process has the model loaded, so that shared pages are split among them
+    barrier.wait()
+    queue.put({'import': imported - start, 'load': loaded - imported, **memory_usage()})
+    barrier.wait()
+
+
+def collect(queue, workers):
+    # One result from each worker, or None as soon as any of them dies (e.g. killed when out of memory)
+    results = []
+    while len(results) < len(workers):
+        try:
+            results.append(queue.get(timeout=1.))
+        except queue_module.Empty:
+            if any(worker.exitcode not in (None, 0) for worker in workers):
+                return None
+    return results
+
+
+@click.command(help='Measure load time and memory of RMVPE processes loading model.pt or model.weights')
+@click.option('--processes', metavar='N', type=int, default=2, show_default=True,
+              help='Number of processes loading the model at the same time')
+@click.option('--format', 'formats', type=click.Choice(['pt', 'weights']), multiple=True,
+              help='Model files to compare (both if not specified)')
+def benchmark_rmvpe_load(processes, formats):
+    context = multiprocessing.get_context('spawn')
+    print(f'{"file":<16}{"import":>9}{"load":>9}{"RSS":>11}{"PSS":>11}{"private":>11}')
+    for fmt in formats or ('pt', 'weights'):
+        model_path = MODEL_DIR / f'model.{fmt}'
+        if not model_path.exists():
+            print(f'{model_path.name:<16}  not found')
+            continue
+        barrier = context.Barrier(processes)
+        queue = context.Queue()
+        workers = [context.Process(target=_worker, args=(model_path, barrier, queue)) for _ in range(processes)]
+        for worker in workers:
+            worker.start()
+        results = collect(queue, workers)
+        if results is None:
+            barrier.abort()
+            for worker in workers:
+                worker.terminate()
+                worker.join()
+            exitcodes = ', '.join(str(worker.exitcode) for worker in workers)
+            print(f'{model_path.name:<16}  a process failed (exit codes {exitcodes})')
+            continue
+        for worker in workers:
+            worker.join()
+        for result in results:
+            print(f'{model_path.name:<16}{result["import"]:>8.2f}s{result["load"]:>8.2f}s'
+                  f'{result.get("rss", 0):>8.0f}MiB{result.get("pss", 0):>8.0f}MiB'
+                  f'{result.get("private_dirty", 0):>8.0f}MiB')
+
+
+if __name__ == '__main__':
+    benchmark_rmvpe_load()
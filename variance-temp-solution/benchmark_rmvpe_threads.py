@@ -0,0 +1,45 @@
+import pathlib
+import time
+
+import click
+
+
+@click.command(help='Find the best split of CPU cores into concurrent RMVPE streams and threads per stream')
+@click.option('--model', metavar='MODEL', default=str(pathlib.Path(__file__).parent / 'assets' / 'rmvpe' / 'model.pt'),
+              show_default=True, help='Path to the RMVPE checkpoint (or exported weights)')
+@click.option('--cores', metavar='CORES', type=int, help='Number of cores to use (all available if not specified)')
+@click.option('--seconds', metavar='SECONDS', type=float, default=5., show_default=True,
+              help='Length of each test clip')
+@click.option('--batch_size', metavar='SIZE', type=int, default=1, show_default=True,
+              help='Number of clips per inference')
+def benchmark_rmvpe_threads(model, cores, seconds, batch_size):
+    from rmvpe import RMVPE
+    from rmvpe.pool import RMVPEPool
+    from rmvpe.runtime import default_num_threads
+    from rmvpe.utils import make_calibration_audio
+
+    if cores is None:
+        cores = default_num_threads()
+    rmvpe = RMVPE(model)
+    audio = make_calibration_audio(seconds=seconds)
+    # Every split processes the same clips, enough to keep each stream busy
+    clips = [audio] * (2 * cores * batch_size)
+    splits = [(n, cores // n) for n in range(1, cores + 1) if cores % n == 0]
+    print(f'{"streams":>8}{"threads":>9}{"time":>10}{"x realtime":>12}')
+    best = None
+    for num_workers, num_threads in splits:
+        pool = RMVPEPool(rmvpe, num_workers=num_workers, num_threads=num_threads)
+        pool.infer_from_audio_batch(clips[:num_workers * batch_size], batch_size=batch_size)  # warm up
+        start = time.perf_counter()
+        pool.infer_from_audio_batch(clips, batch_size=batch_size)
+        elapsed = time.perf_counter() - start
+        pool.shutdown()
+        speed = len(clips) * seconds / elapsed
+        print(f'{num_workers:>8}{num_threads:>9}{elapsed:>9.2f}s{speed:>12.1f}')
+        if best is None or speed > best[2]:
+            best = (num_workers, num_threads, speed)
+    print(f'Best split: --workers {best[0]} --threads {best[1]}')
+
+
+if __name__ == '__main__':
+    benchmark_rmvpe_threads()
@@ -6,11 +6,12 @@ from math import isclose
 from typing import Tuple, List
 
 import click
-import librosa
 import numpy as np
 from tqdm import tqdm
 
-from get_pitch import get_pitch
+from audio_cache import AudioCache
+from disk_cache import DiskCache
+from get_pitch import PITCH_ALGORITHMS, configure_parselmouth_workers, configure_rmvpe_threads, iter_pitch_from_files
 
 
 def align_notes_to_words(
@@ -106,20 +107,71 @@ def cli():
 )
 @click.option(
     "--pe",
-    type=str,
+    type=click.Choice(PITCH_ALGORITHMS),
     default="parselmouth",
-    help="Pitch extractor (parselmouth, rmvpe)",
-    metavar="ALGORITHM",
+    show_default=True,
+    help="Pitch extractor",
 )
-def csv2ds(transcription_file, wavs_folder, tolerance, hop_size, sample_rate, pe):
+@click.option(
+    "--batch_size",
+    type=int,
+    default=None,
+    help="Number of waveforms to extract pitch from at once (auto-tuned if not specified)",
+    metavar="INT",
+)
+@click.option(
+    "--cache_dir",
+    type=click.Path(file_okay=False, path_type=pathlib.Path),
+    default=None,
+    help="Directory to cache extracted pitch and decoded audio across runs",
+    metavar="DIR",
+)
+@click.option(
+    "--audio_cache_size",
+    type=float,
+    default=4,
+    show_default=True,
+    help="Size limit of the decoded audio in the cache, in GiB (audio is not cached if the files do not fit)",
+    metavar="GIB",
+)
+@click.option(
+    "--workers",
+    type=int,
+    default=1,
+    show_default=True,
+    help="Number of concurrent RMVPE inference streams, or of processes for parselmouth",
+    metavar="N",
+)
+@click.option(
+    "--threads",
+    type=int,
+    default=None,
+    help="Number of threads per RMVPE stream (all cores divided by the number of streams if not specified)",
+    metavar="M",
+)
+def csv2ds(transcription_file, wavs_folder, tolerance, hop_size, sample_rate, pe, batch_size, cache_dir,
+           audio_cache_size, workers, threads):
     """Convert a transcription file to DS file"""
     assert wavs_folder.is_dir(), "wavs folder not found."
+    configure_rmvpe_threads(num_workers=workers, num_threads=threads)
+    configure_parselmouth_workers(num_workers=workers)
+    cache = DiskCache(cache_dir) if cache_dir is not None else None
+    audio_cache = AudioCache(cache_dir, max_size=int(audio_cache_size * (1 << 30))) if cache_dir is not None else None
     out_ds = {}
     out_exists = []
     with open(transcription_file, "r", encoding="utf-8") as f:
-        for trans_line in tqdm(csv.DictReader(f)):
+        trans_lines = list(csv.DictReader(f))
+        for trans_line in trans_lines:
+            assert (wavs_folder / f"{trans_line['name']}.wav").is_file(), f"{trans_line['name']}.wav not found."
+        # Extract f0_seq
+        # length = len(wav) + (win_size - hop_size) // 2 + (win_size - hop_size + 1) // 2
+        # length = ceil((length - win_size) / hop_size)
+        pitches = iter_pitch_from_files(
+            pe, [wavs_folder / f"{trans_line['name']}.wav" for trans_line in trans_lines], hop_size, sample_rate,
+            batch_size=batch_size, cache=cache, audio_cache=audio_cache
+        )
+        for trans_line, (f0_timestep, f0, _) in zip(tqdm(trans_lines), pitches):
             item_name = trans_line["name"]
-            wav_fn = wavs_folder / f"{item_name}.wav"
             ds_fn = wavs_folder / f"{item_name}.ds"
             ph_dur = list(map(float, trans_line["ph_dur"].strip().split()))
             ph_num = list(map(int, trans_line["ph_num"].strip().split()))
@@ -127,7 +179,6 @@ def csv2ds(transcription_file, wavs_folder, tolerance, hop_size, sample_rate, pe
             note_dur = list(map(float, trans_line["note_dur"].strip().split()))
             note_glide = trans_line["note_glide"].strip().split() if "note_glide" in trans_line else None
 
-            assert wav_fn.is_file(), f"{item_name}.wav not found."
             assert len(ph_dur) == sum(ph_num), "ph_dur and ph_num mismatch."
             assert len(note_seq) == len(note_dur), "note_seq and note_dur should have the same length."
             if note_glide:
@@ -143,11 +194,6 @@ def csv2ds(transcription_file, wavs_folder, tolerance, hop_size, sample_rate, pe
                 note_seq, note_dur, note_slur = align_notes_to_words(
                     ph_dur, ph_num, note_seq, note_dur, tol=tolerance
                 )
-            # Extract f0_seq
-            wav, _ = librosa.load(wav_fn, sr=sample_rate, mono=True)
-            # length = len(wav) + (win_size - hop_size) // 2 + (win_size - hop_size + 1) // 2
-            # length = ceil((length - win_size) / hop_size)
-            f0_timestep, f0, _ = get_pitch(pe, wav, hop_size, sample_rate)
             ds_content = [
                 {
                     "offset": 0.0,
@@ -167,6 +213,9 @@ def csv2ds(transcription_file, wavs_folder, tolerance, hop_size, sample_rate, pe
             out_ds[ds_fn] = ds_content
             if ds_fn.exists():
                 out_exists.append(ds_fn)
+    if cache is not None:
+        click.echo(f"Pitch cache: {cache.summary()}")
+        click.echo(f"Audio cache: {audio_cache.summary()}")
     if not out_exists or click.confirm(f"Overwrite {len(out_exists)} existing DS files?", abort=False):
         for ds_fn, ds_content in out_ds.items():
             with open(ds_fn, "w", encoding="utf-8") as f:
@@ -11,15 +11,16 @@ from csv import DictReader, DictWriter
 
 import click
 
-from get_pitch import get_pitch_parselmouth
+import f0_batch
+from audio_cache import AudioCache
+from disk_cache import DiskCache
+from get_pitch import configure_parselmouth_workers, iter_pitch_from_files
 
 warns = []
 
 
-def get_aligned_pitch(wav_path: pathlib.Path, total_secs: float, timestep: float):
-    waveform, _ = librosa.load(wav_path, sr=44100, mono=True)
-    _, f0, _ = get_pitch_parselmouth(waveform, 512, 44100)
-    pitch = librosa.hz_to_midi(f0)
+def get_aligned_pitch(f0: np.ndarray, total_secs: float, timestep: float):
+    pitch = f0_batch.hz_to_midi(f0)
     if pitch.shape[0] < total_secs / timestep:
         pad = math.ceil(total_secs / timestep) - pitch.shape[0]
         pitch = np.pad(pitch, [0, pad], mode='constant', constant_values=[0, pitch[-1]])
@@ -91,10 +92,18 @@ def correct_cents():
 @click.option('--error_ratio', metavar='RATIO', type=float, default=0.4,
               help='If the percentage of pitch points within a deviation of 50 cents compared to the note label '
                    'is lower than this value, a warning will be raised.')
+@click.option('--cache_dir', metavar='DIR', help='Directory to cache extracted pitch and decoded audio across runs')
+@click.option('--audio_cache_size', metavar='GIB', type=float, default=4, show_default=True,
+              help='Size limit of the decoded audio in the cache, in GiB (audio is not cached if the files do not fit)')
+@click.option('--workers', metavar='N', type=int, default=1, show_default=True,
+              help='Number of processes for pitch extraction (0 for all cores)')
 def csv(
         transcriptions,
         waveforms,
-        error_ratio
+        error_ratio,
+        cache_dir,
+        audio_cache_size,
+        workers
 ):
     transcriptions = pathlib.Path(transcriptions).resolve()
     waveforms = pathlib.Path(waveforms).resolve()
@@ -104,11 +113,19 @@ def csv(
         for item in reader:
             items.append(OrderedDict(item))
 
+    configure_parselmouth_workers(num_workers=workers)
+    cache = DiskCache(cache_dir) if cache_dir is not None else None
+    audio_cache = AudioCache(cache_dir, max_size=int(audio_cache_size * (1 << 30))) if cache_dir is not None else None
     timestep = 512 / 44100
-    for item in tqdm.tqdm(items):
+    # With several workers, pitch of the following files is extracted while the current one is processed
+    pitches = iter_pitch_from_files(
+        'parselmouth', [waveforms / (item['name'] + '.wav') for item in items], 512, 44100,
+        cache=cache, audio_cache=audio_cache
+    )
+    for item, (_, f0, _) in tqdm.tqdm(zip(items, pitches), total=len(items)):
         item: OrderedDict
         ref_pitch = get_aligned_pitch(
-            wav_path=waveforms / (item['name'] + '.wav'),
+            f0=f0,
             total_secs=sum(float(d) for d in item['note_dur'].split()),
             timestep=timestep
         )
@@ -121,6 +138,9 @@ def csv(
         writer = DictWriter(f, fieldnames=['name', 'ph_seq', 'ph_dur', 'ph_num', 'note_seq', 'note_dur'])
         writer.writeheader()
         writer.writerows(items)
+    if cache is not None:
+        print(f'Pitch cache: {cache.summary()}')
+        print(f'Audio cache: {audio_cache.summary()}')
     save_warnings(transcriptions.parent)
 
 
@@ -129,20 +149,34 @@ def csv(
 @click.option('--error_ratio', metavar='RATIO', type=float, default=0.4,
               help='If the percentage of pitch points within a deviation of 50 cents compared to the note label '
                    'is lower than this value, a warning will be raised.')
+@click.option('--cache_dir', metavar='DIR', help='Directory to cache extracted pitch and decoded audio across runs')
+@click.option('--audio_cache_size', metavar='GIB', type=float, default=4, show_default=True,
+              help='Size limit of the decoded audio in the cache, in GiB (audio is not cached if the files do not fit)')
+@click.option('--workers', metavar='N', type=int, default=1, show_default=True,
+              help='Number of processes for pitch extraction (0 for all cores)')
 def ds(
         ds_dir,
-        error_ratio
+        error_ratio,
+        cache_dir,
+        audio_cache_size,
+        workers
 ):
     ds_dir = pathlib.Path(ds_dir).resolve()
     assert ds_dir.exists(), 'The directory of DS files does not exist.'
 
+    configure_parselmouth_workers(num_workers=workers)
+    cache = DiskCache(cache_dir) if cache_dir is not None else None
+    audio_cache = AudioCache(cache_dir, max_size=int(audio_cache_size * (1 << 30))) if cache_dir is not None else None
     timestep = 512 / 44100
-    for ds_file in tqdm.tqdm(ds_dir.glob('*.ds')):
-        if not ds_file.is_file():
-            continue
-
+    ds_files = [ds_file for ds_file in ds_dir.glob('*.ds') if ds_file.is_file()]
+    for ds_file in ds_files:
         assert ds_file.with_suffix('.wav').exists(), \
             f'Missing corresponding .wav file of {ds_file.name}.'
+    pitches = iter_pitch_from_files(
+        'parselmouth', [ds_file.with_suffix('.wav') for ds_file in ds_files], 512, 44100,
+        cache=cache, audio_cache=audio_cache
+    )
+    for ds_file, (_, f0, _) in tqdm.tqdm(zip(ds_files, pitches), total=len(ds_files)):
         with open(ds_file, 'r', encoding='utf8') as f:
             params = json.load(f)
         if not isinstance(params, list):
@@ -150,7 +184,7 @@ def ds(
         params = [OrderedDict(p) for p in params]
 
         ref_pitch = get_aligned_pitch(
-            wav_path=ds_file.with_suffix('.wav'),
+            f0=f0,
             total_secs=params[-1]['offset'] + sum(float(d) for d in params[-1]['note_dur'].split()),
             timestep=timestep
         )
@@ -164,6 +198,9 @@ def ds(
 
         with open(ds_file, 'w', encoding='utf8') as f:
             json.dump(params, f, ensure_ascii=False, indent=2)
+    if cache is not None:
+        print(f'Pitch cache: {cache.summary()}')
+        print(f'Audio cache: {audio_cache.summary()}')
     save_warnings(ds_dir)
 
 
@@ -0,0 +1,101 @@
+import hashlib
+import os
+import pathlib
+import uuid
+
+import numpy as np
+
+
+file_hashes = {}
+
+
+def hash_file(path, chunk_size=1 << 20) -> str:
+    # Memoized on the path, size and modification time, so each file is read once for all caches of a run
+    stat = os.stat(path)
+    file_key = (str(pathlib.Path(path).resolve()), stat.st_size, stat.st_mtime_ns)
+    if file_key not in file_hashes:
+        h = hashlib.blake2b(digest_size=20)
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                h.update(chunk)
+        file_hashes[file_key] = h.hexdigest()
+    return file_hashes[file_key]
+
+
+def make_key(*parts) -> str:
+    h = hashlib.blake2b(digest_size=20)
+    for part in parts:
+        h.update(repr(part).encode('utf8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+class DiskCache:
+    """
+    Content-addressed cache of numpy arrays on disk.
+    Each entry is a group of .npy files named <key>.<name>.npy, which are loaded memory-mapped.
+    When the total size exceeds max_size (in bytes), the least recently used entries are evicted until it is
+    below low_water * max_size, so that the directory is scanned only once per that much new data.
+    """
+
+    def __init__(self, cache_dir, max_size=1 << 30, low_water=0.9):
+        self.cache_dir = pathlib.Path(cache_dir).resolve()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+        self.low_water = low_water
+        self.hits = 0
+        self.misses = 0
+        self.total_size = sum(f.stat().st_size for f in self.cache_dir.glob('*/*.npy'))
+
+    def _path(self, key, name) -> pathlib.Path:
+        return self.cache_dir / key[:2] / f'{key}.{name}.npy'
+
+    def get(self, key, names, mmap_mode='r'):
+        paths = [self._path(key, name) for name in names]
+        try:
+            arrays = tuple(np.load(p, mmap_mode=mmap_mode) for p in paths)
+        except (FileNotFoundError, ValueError):
+            self.misses += 1
+            return None
+        for p in paths:
+            os.utime(p)
+        self.hits += 1
+        return arrays
+
+    def put(self, key, **arrays):
+        for name, array in arrays.items():
+            path = self._path(key, name)
+            path.parent.mkdir(exist_ok=True)
+            tmp_path = path.with_name(f'{path.name}.{uuid.uuid4().hex}.tmp')
+            with open(tmp_path, 'wb') as f:
+                np.save(f, np.ascontiguousarray(array))
+            try:
+                # An existing file of the same entry is replaced
+                self.total_size -= path.stat().st_size
+            except FileNotFoundError:
+                pass
+            os.replace(tmp_path, path)
+            self.total_size += path.stat().st_size
+        if self.total_size > self.max_size:
+            self.evict()
+
+    def evict(self):
+        entries = {}
+        for f in self.cache_dir.glob('*/*.npy'):
+            stat = f.stat()
+            key = f.name.split('.', 1)[0]
+            files, size, mtime = entries.get(key, ([], 0, 0.))
+            entries[key] = (files + [f], size + stat.st_size, max(mtime, stat.st_mtime))
+        self.total_size = sum(size for _, size, _ in entries.values())
+        for files, size, _ in sorted(entries.values(), key=lambda e: e[2]):
+            if self.total_size <= self.max_size * self.low_water:
+                break
+            for f in files:
+                f.unlink(missing_ok=True)
+            self.total_size -= size
+
+    def summary(self) -> str:
+        return f'{self.hits} hits, {self.misses} misses ({self.total_size / (1 << 20):.1f} MiB in {self.cache_dir})'
@@ -8,21 +8,38 @@ import numpy as np
 import tqdm
 from typing import List
 
-from get_pitch import get_pitch
+import f0_batch
+from audio_cache import AudioCache
+from disk_cache import DiskCache
+from get_pitch import PITCH_ALGORITHMS, configure_parselmouth_workers, configure_rmvpe_threads, iter_pitch_from_files
 
 
 @click.command(help='Estimate note pitch from transcriptions and corresponding waveforms')
 @click.argument('transcriptions', metavar='TRANSCRIPTIONS')
 @click.argument('waveforms', metavar='WAVS')
-@click.option('--pe', metavar='ALGORITHM', default='parselmouth',
-              help='Pitch extractor (parselmouth, rmvpe)')
+@click.option('--pe', type=click.Choice(PITCH_ALGORITHMS), default='parselmouth', show_default=True,
+              help='Pitch extractor')
 @click.option('--rest_uv_ratio', metavar='RATIO', type=float, default=0.85,
               help='The minimum percentage of unvoiced length for a note to be regarded as rest')
+@click.option('--batch_size', metavar='SIZE', type=int,
+              help='Number of waveforms to extract pitch from at once (auto-tuned if not specified)')
+@click.option('--cache_dir', metavar='DIR', help='Directory to cache extracted pitch and decoded audio across runs')
+@click.option('--audio_cache_size', metavar='GIB', type=float, default=4, show_default=True,
+              help='Size limit of the decoded audio in the cache, in GiB (audio is not cached if the files do not fit)')
+@click.option('--workers', metavar='N', type=int, default=1, show_default=True,
+              help='Number of concurrent RMVPE inference streams, or of processes for parselmouth')
+@click.option('--threads', metavar='M', type=int,
+              help='Number of threads per RMVPE stream (all cores divided by the number of streams if not specified)')
 def estimate_midi(
         transcriptions: str,
         waveforms: str,
         pe: str = 'parselmouth',
-        rest_uv_ratio: float = 0.85
+        rest_uv_ratio: float = 0.85,
+        batch_size: int = None,
+        cache_dir: str = None,
+        audio_cache_size: float = 4,
+        workers: int = 1,
+        threads: int = None
 ):
     transcriptions = pathlib.Path(transcriptions).resolve()
     waveforms = pathlib.Path(waveforms).resolve()
@@ -32,8 +49,16 @@ def estimate_midi(
         for item in reader:
             items.append(item)
 
+    configure_rmvpe_threads(num_workers=workers, num_threads=threads)
+    configure_parselmouth_workers(num_workers=workers)
+    cache = DiskCache(cache_dir) if cache_dir is not None else None
+    audio_cache = AudioCache(cache_dir, max_size=int(audio_cache_size * (1 << 30))) if cache_dir is not None else None
     timestep = 512 / 44100
-    for item in tqdm.tqdm(items):
+    pitches = iter_pitch_from_files(
+        pe, [waveforms / (item['name'] + '.wav') for item in items], 512, 44100,
+        batch_size=batch_size, cache=cache, audio_cache=audio_cache
+    )
+    for item, (_, f0, uv) in zip(tqdm.tqdm(items), pitches):
         item: dict
         ph_dur = [float(d) for d in item['ph_dur'].split()]
         ph_num = [int(n) for n in item['ph_num'].split()]
@@ -46,9 +71,7 @@ def estimate_midi(
             i += num
 
         total_secs = sum(ph_dur)
-        waveform, _ = librosa.load(waveforms / (item['name'] + '.wav'), sr=44100, mono=True)
-        _, f0, uv = get_pitch(pe, waveform, 512, 44100)
-        pitch = librosa.hz_to_midi(f0)
+        pitch = f0_batch.hz_to_midi(f0)
         if pitch.shape[0] < total_secs / timestep:
             pad = math.ceil(total_secs / timestep) - pitch.shape[0]
             pitch = np.pad(pitch, [0, pad], mode='constant', constant_values=[0, pitch[-1]])
@@ -82,6 +105,9 @@ def estimate_midi(
         writer = csv.DictWriter(f, fieldnames=['name', 'ph_seq', 'ph_dur', 'ph_num', 'note_seq', 'note_dur'])
         writer.writeheader()
         writer.writerows(items)
+    if cache is not None:
+        print(f'Pitch cache: {cache.summary()}')
+        print(f'Audio cache: {audio_cache.summary()}')
 
 
 if __name__ == '__main__':
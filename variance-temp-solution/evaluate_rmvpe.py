@@ -0,0 +1,56 @@
+import pathlib
+import time
+
+import click
+import librosa
+import numpy as np
+
+VARIANTS = {
+    'int8': {'quantize': 'dynamic', 'max_cents_error': None},
+    'int8-static': {'quantize': 'static', 'max_cents_error': None},
+    'bf16': {'precision': 'bfloat16', 'max_cents_error': None},
+    'gated': {'silence_threshold': -60},
+}
+
+
+@click.command(help='Compare reduced-precision RMVPE variants against the float32 model')
+@click.option('--model', metavar='MODEL', default=str(
+    pathlib.Path(__file__).parent / 'assets' / 'rmvpe' / 'model.pt'
+), show_default=True, help='Path to the RMVPE PyTorch checkpoint')
+@click.option('--wav', metavar='WAV', default=str(
+    pathlib.Path(__file__).parent.parent / 'acoustic_forced_alignment' / 'assets' / '2001000001.wav'
+), show_default=True, help='Waveform to evaluate on')
+@click.option('--variant', 'variants', type=click.Choice(list(VARIANTS)), multiple=True,
+              help='Variants to evaluate (all if not specified)')
+def evaluate_rmvpe(model, wav, variants):
+    from rmvpe import RMVPE
+    from rmvpe.utils import cents_error, voicing_agreement
+
+    waveform, sr = librosa.load(wav, sr=None, mono=True)
+    reference = RMVPE(model)
+    ref_f0 = reference.infer_from_audio(waveform, sample_rate=sr)
+    start = time.perf_counter()
+    reference.infer_from_audio(waveform, sample_rate=sr)
+    ref_latency = time.perf_counter() - start
+    print(f'{"variant":<12}{"latency":>10}{"speedup":>10}{"mean cents":>12}{"p95 cents":>12}'
+          f'{"voicing":>10}{"skipped":>10}')
+    print(f'{"float32":<12}{ref_latency:>9.3f}s{1.:>9.2f}x{0.:>12.2f}{0.:>12.2f}{1.:>10.2%}{0.:>10.2%}')
+    for variant in variants or VARIANTS:
+        rmvpe = RMVPE(model, **VARIANTS[variant])
+        rmvpe.infer_from_audio(waveform, sample_rate=sr)
+        start = time.perf_counter()
+        f0 = rmvpe.infer_from_audio(waveform, sample_rate=sr)
+        latency = time.perf_counter() - start
+        cents = cents_error(ref_f0, f0)
+        # No cents error without frames voiced in both
+        cents_stats = f'{np.mean(cents):>12.2f}{np.percentile(cents, 95):>12.2f}' \
+            if cents.shape[0] > 0 else f'{"-":>12}{"-":>12}'
+        print(
+            f'{variant:<12}{latency:>9.3f}s{ref_latency / latency:>9.2f}x'
+            f'{cents_stats}{voicing_agreement(ref_f0, f0):>10.2%}'
+            f'{rmvpe.skipped_fractions[0]:>10.2%}'
+        )
+
+
+if __name__ == '__main__':
+    evaluate_rmvpe()
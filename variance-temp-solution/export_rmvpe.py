@@ -0,0 +1,29 @@
+import pathlib
+
+import click
+
+
+@click.command(help='Export the RMVPE model for the rmvpe-onnx and rmvpe-jit pitch extractors, '
+                    'or as memory-mapped weights')
+@click.option('--model', metavar='MODEL', default=str(pathlib.Path(__file__).parent / 'assets' / 'rmvpe' / 'model.pt'),
+              show_default=True, help='Path to the RMVPE PyTorch checkpoint')
+@click.option('--format', 'fmt', type=click.Choice(['onnx', 'jit', 'weights']), default='onnx', show_default=True,
+              help='Export format')
+@click.option('--out', metavar='FILE', help='Output path (defaults to model.<format> next to the checkpoint)')
+def export_rmvpe(model, fmt, out):
+    model = pathlib.Path(model).resolve()
+    out = pathlib.Path(out).resolve() if out is not None else model.with_suffix(f'.{fmt}')
+    if fmt == 'onnx':
+        from rmvpe.export import export_onnx
+        export_onnx(model, out)
+    elif fmt == 'jit':
+        from rmvpe.export import export_jit
+        export_jit(model, out)
+    else:
+        from rmvpe.export import export_weights
+        export_weights(model, out)
+    print(f'Exported RMVPE to {out}')
+
+
+if __name__ == '__main__':
+    export_rmvpe()
@@ -0,0 +1,89 @@
+import numpy as np
+
+
+def pack(tracks):
+    """
+    Concatenate 1-D tracks into one buffer. offsets[i]: offsets[i + 1] is the slice of track i.
+    """
+    offsets = np.zeros(len(tracks) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(t) for t in tracks])
+    if len(tracks) == 0:
+        return np.zeros(0), offsets
+    return np.concatenate(tracks), offsets
+
+
+def unpack(buffer, offsets):
+    return [buffer[offsets[i]: offsets[i + 1]] for i in range(len(offsets) - 1)]
+
+
+def _interp(x, x0, y0, x1, y1):
+    # Same arithmetic as np.interp between two known points
+    slope = (y1 - y0) / (x1 - x0)
+    return np.where(x == x0, y0, slope * (x - x0) + y0)
+
+
+def interp_f0_batch(f0, offsets, uv=None):
+    """
+    Fill unvoiced frames of every track by linear interpolation of log2(f0) between the nearest voiced frames
+    of the same track (holding the first and last voiced values at the edges).
+    Tracks without voiced frames stay at 0. Same results as get_pitch.interp_f0 on each track.
+    :return: f0, uv (buffers with the same offsets)
+    """
+    if uv is None:
+        uv = f0 == 0
+    n = f0.shape[0]
+    with np.errstate(divide='ignore'):
+        log_f0 = np.log2(f0)
+    positions = np.flatnonzero(uv)
+    if positions.shape[0] == 0:
+        return 2 ** log_f0, uv
+    # Nearest voiced frame before / after each unvoiced frame, restricted to the same track
+    index = np.arange(n)
+    prev = np.maximum.accumulate(np.where(uv, -1, index))[positions]
+    after = np.minimum.accumulate(np.where(uv, n, index)[::-1])[::-1][positions]
+    segment = np.searchsorted(offsets, positions, side='right') - 1
+    has_prev = prev >= offsets[segment]
+    has_next = after < offsets[segment + 1]
+    y0 = log_f0[np.where(has_prev, prev, 0)].astype(np.float64)
+    y1 = log_f0[np.where(has_next, after, 0)].astype(np.float64)
+    with np.errstate(invalid='ignore'):
+        filled = np.where(
+            has_prev & has_next, _interp(positions.astype(np.float64), prev.astype(np.float64), y0, after, y1),
+            np.where(has_prev, y0, np.where(has_next, y1, -np.inf))
+        )
+    log_f0[positions] = filled
+    return 2 ** log_f0, uv
+
+
+def resample_align_batch(points, offsets, original_timestep, target_timestep, align_lengths):
+    """
+    Resample every track from original_timestep to target_timestep by linear interpolation,
+    then cut or pad (with the last interpolated value) to align_lengths[i] frames.
+    Same results as get_pitch.resample_align_curve on each track.
+    :return: points, offsets (of the resampled buffer)
+    """
+    lengths = np.diff(offsets)
+    align_lengths = np.asarray(align_lengths, dtype=np.int64)
+    new_offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    new_offsets[1:] = np.cumsum(align_lengths)
+    result = np.empty(int(new_offsets[-1]), dtype=points.dtype)
+    if len(lengths) == 0:
+        return result, new_offsets
+    # The target times (as np.arange(0, t_max, target_timestep)) and the source grid are shared by all tracks.
+    # np.interp itself stays per track: a single pass in C is faster than any combination of whole-array passes.
+    n_interp = np.maximum(np.ceil((lengths - 1) * original_timestep / target_timestep), 0).astype(np.int64)
+    times = np.arange(int(n_interp.max())) * target_timestep
+    grid = original_timestep * np.arange(int(lengths.max()))
+    for i in range(len(lengths)):
+        out = result[new_offsets[i]: new_offsets[i + 1]]
+        n = min(int(n_interp[i]), out.shape[0])
+        out[:n] = np.interp(times[:n], grid[:lengths[i]], points[offsets[i]: offsets[i + 1]])
+        if n < out.shape[0]:
+            out[n:] = out[n - 1] if n > 0 else points[offsets[i + 1] - 1]
+    return result, new_offsets
+
+
+def hz_to_midi(f0):
+    # Same as librosa.hz_to_midi, over a whole buffer at once
+    with np.errstate(divide='ignore'):
+        return 12 * (np.log2(np.asanyarray(f0)) - np.log2(440.0)) + 69
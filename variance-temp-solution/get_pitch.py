@@ -1,7 +1,11 @@
 import pathlib
 
 import numpy as np
-import parselmouth
+
+import f0_batch
+from audio_cache import AudioCache, load_audio
+from resampler import default_resampler
+from disk_cache import DiskCache, hash_file, make_key
 
 
 def norm_f0(f0):
@@ -19,74 +23,268 @@ def denorm_f0(f0, uv, pitch_padding=None):
 
 
 def interp_f0(f0, uv=None):
-    if uv is None:
-        uv = f0 == 0
-    f0 = norm_f0(f0)
-    if sum(uv) == len(f0):
-        f0[uv] = -np.inf
-    elif sum(uv) > 0:
-        f0[uv] = np.interp(np.where(uv)[0], np.where(~uv)[0], f0[~uv])
-    return denorm_f0(f0, uv=None), uv
+    return f0_batch.interp_f0_batch(f0, np.array([0, f0.shape[0]]), uv=uv)
 
 
 def resample_align_curve(points: np.ndarray, original_timestep: float, target_timestep: float, align_length: int):
-    t_max = (len(points) - 1) * original_timestep
-    curve_interp = np.interp(
-        np.arange(0, t_max, target_timestep),
-        original_timestep * np.arange(len(points)),
-        points
-    ).astype(points.dtype)
-    delta_l = align_length - len(curve_interp)
-    if delta_l < 0:
-        curve_interp = curve_interp[:align_length]
-    elif delta_l > 0:
-        curve_interp = np.concatenate((curve_interp, np.full(delta_l, fill_value=curve_interp[-1])), axis=0)
-    return curve_interp
+    return f0_batch.resample_align_batch(
+        points, np.array([0, points.shape[0]]), original_timestep, target_timestep, [align_length]
+    )[0]
+
+
+parselmouth_engines = {}
+parselmouth_workers = {'num_workers': 1}
+
+
+def configure_parselmouth_workers(num_workers=1):
+    # Analyse files in a pool of num_workers processes (all cores if 0), splitting long files into chunks;
+    # this must be called before the engine is first used
+    parselmouth_workers.update(num_workers=num_workers)
+
+
+def get_parselmouth_engine():
+    if 'default' not in parselmouth_engines:
+        from parselmouth_engine import ParselmouthEngine
+        parselmouth_engines['default'] = ParselmouthEngine(num_workers=parselmouth_workers['num_workers'])
+    return parselmouth_engines['default']
 
 
 def get_pitch_parselmouth(wav_data, hop_size, audio_sample_rate, interp_uv=True):
+    return get_pitch_parselmouth_batch([wav_data], hop_size, audio_sample_rate, interp_uv=interp_uv)[0]
+
+
+def get_pitch_parselmouth_batch(wav_datas, hop_size, audio_sample_rate, interp_uv=True):
     time_step = hop_size / audio_sample_rate
     f0_min = 65.
     f0_max = 1100.
 
-    # noinspection PyArgumentList
-    f0 = (
-        parselmouth.Sound(wav_data, sampling_frequency=audio_sample_rate)
-        .to_pitch_ac(
-            time_step=time_step, voicing_threshold=0.6, pitch_floor=f0_min, pitch_ceiling=f0_max
-        ).selected_array["frequency"]
+    f0s = get_parselmouth_engine().to_pitch_ac(
+        [(wav_data, audio_sample_rate) for wav_data in wav_datas],
+        time_step=time_step, voicing_threshold=0.6, pitch_floor=f0_min, pitch_ceiling=f0_max
     )
+    f0, offsets = f0_batch.pack(list(f0s))
     uv = f0 == 0
     if interp_uv:
-        f0, uv = interp_f0(f0, uv)
-    return time_step, f0, uv
+        f0, uv = f0_batch.interp_f0_batch(f0, offsets, uv)
+    return [
+        (time_step, f0_item, uv_item)
+        for f0_item, uv_item in zip(f0_batch.unpack(f0, offsets), f0_batch.unpack(uv, offsets))
+    ]
 
 
-rmvpe = None
+def get_pitch_yin(wav_data, hop_size, audio_sample_rate, interp_uv=True):
+    return get_pitch_yin_batch([wav_data], hop_size, audio_sample_rate, interp_uv=interp_uv)[0]
 
 
-def get_pitch_rmvpe(wav_data, hop_size, audio_sample_rate, interp_uv=True):
-    global rmvpe
-    if rmvpe is None:
-        from rmvpe import RMVPE
-        rmvpe = RMVPE(pathlib.Path(__file__).parent / 'assets' / 'rmvpe' / 'model.pt')
-    f0 = rmvpe.infer_from_audio(wav_data, sample_rate=audio_sample_rate)
+def get_pitch_yin_batch(wav_datas, hop_size, audio_sample_rate, interp_uv=True):
+    from yin import yin_batch
+    time_step = hop_size / audio_sample_rate
+    f0_min = 65.
+    f0_max = 1100.
+
+    f0s = yin_batch(wav_datas, audio_sample_rate, hop_size, f0_min=f0_min, f0_max=f0_max)
+    f0, offsets = f0_batch.pack(f0s)
     uv = f0 == 0
-    f0, uv = interp_f0(f0, uv)
+    if interp_uv:
+        f0, uv = f0_batch.interp_f0_batch(f0, offsets, uv)
+    return [
+        (time_step, f0_item, uv_item)
+        for f0_item, uv_item in zip(f0_batch.unpack(f0, offsets), f0_batch.unpack(uv, offsets))
+    ]
+
+
+RMVPE_ALGORITHMS = ('rmvpe', 'rmvpe-onnx', 'rmvpe-jit', 'rmvpe-int8', 'rmvpe-int8-static', 'rmvpe-bf16',
+                    'rmvpe-gated')
+PITCH_ALGORITHMS = ('parselmouth', 'yin') + RMVPE_ALGORITHMS
+rmvpe_models = {}
+rmvpe_threads = {'num_workers': 1, 'num_threads': None}
+
+
+def configure_rmvpe_threads(num_workers=1, num_threads=None, num_interop_threads=None):
+    # Run PyTorch RMVPE variants as num_workers concurrent streams with num_threads intra-op threads each;
+    # this must be called before the models are loaded
+    rmvpe_threads.update(num_workers=num_workers, num_threads=num_threads)
+    if num_interop_threads is not None:
+        from rmvpe.pool import set_num_interop_threads
+        set_num_interop_threads(num_interop_threads)
+
 
+def rmvpe_checkpoint(model_dir):
+    # Weights exported by export_rmvpe.py --format weights are memory-mapped and shared between processes,
+    # but only used if they were exported from the current model.pt
+    checkpoint = model_dir / 'model.pt'
+    weights = model_dir / 'model.weights'
+    if weights.exists():
+        from rmvpe.flat import exported_from
+        if not checkpoint.exists() or exported_from(weights, checkpoint):
+            checkpoint = weights
+        else:
+            print(f'Warning: {weights} was not exported from the current {checkpoint.name} and is ignored; '
+                  f'run export_rmvpe.py --format weights again to use it.')
+    print(f'Loading RMVPE from {checkpoint}')
+    return checkpoint
+
+
+def warn_stale_export(model, checkpoint):
+    # Exported graphs cannot fall back to model.pt, so they are still used
+    from rmvpe.fingerprint import matches_checkpoint
+    if checkpoint.exists() and not matches_checkpoint(model.source, checkpoint):
+        fmt = model.model_path.suffix[1:]
+        print(f'Warning: {model.model_path} was not exported from the current {checkpoint.name}; '
+              f'run export_rmvpe.py --format {fmt} again.')
+
+
+def load_rmvpe(algorithm='rmvpe'):
+    if algorithm not in rmvpe_models:
+        model_dir = pathlib.Path(__file__).parent / 'assets' / 'rmvpe'
+        if algorithm not in ('rmvpe-onnx', 'rmvpe-jit'):
+            checkpoint = rmvpe_checkpoint(model_dir)
+        if algorithm == 'rmvpe':
+            from rmvpe import RMVPE
+            rmvpe_models[algorithm] = RMVPE(checkpoint)
+        elif algorithm == 'rmvpe-int8':
+            from rmvpe import RMVPE
+            rmvpe_models[algorithm] = RMVPE(checkpoint, quantize='dynamic')
+        elif algorithm == 'rmvpe-int8-static':
+            from rmvpe import RMVPE
+            rmvpe_models[algorithm] = RMVPE(checkpoint, quantize='static')
+        elif algorithm == 'rmvpe-bf16':
+            from rmvpe import RMVPE
+            rmvpe_models[algorithm] = RMVPE(checkpoint, precision='bfloat16')
+        elif algorithm == 'rmvpe-gated':
+            from rmvpe import RMVPE
+            rmvpe_models[algorithm] = RMVPE(checkpoint, silence_threshold=-60)
+        elif algorithm == 'rmvpe-onnx':
+            from rmvpe.runtime import RMVPEOnnx
+            rmvpe_models[algorithm] = RMVPEOnnx(model_dir / 'model.onnx')
+        elif algorithm == 'rmvpe-jit':
+            from rmvpe.runtime import RMVPEJit
+            rmvpe_models[algorithm] = RMVPEJit(model_dir / 'model.jit')
+        else:
+            raise ValueError(f" [x] Unknown RMVPE variant: {algorithm}")
+        if algorithm in ('rmvpe-onnx', 'rmvpe-jit'):
+            warn_stale_export(rmvpe_models[algorithm], model_dir / 'model.pt')
+        if algorithm not in ('rmvpe-onnx', 'rmvpe-jit') \
+                and (rmvpe_threads['num_workers'] > 1 or rmvpe_threads['num_threads'] is not None):
+            from rmvpe.pool import RMVPEPool
+            rmvpe_models[algorithm] = RMVPEPool(rmvpe_models[algorithm], **rmvpe_threads)
+    return rmvpe_models[algorithm]
+
+
+def get_pitch_rmvpe(wav_data, hop_size, audio_sample_rate, interp_uv=True, algorithm='rmvpe'):
+    return get_pitch_rmvpe_batch(
+        [wav_data], hop_size, audio_sample_rate, interp_uv=interp_uv, batch_size=1, algorithm=algorithm
+    )[0]
+
+
+def get_pitch_rmvpe_batch(wav_datas, hop_size, audio_sample_rate, interp_uv=True, batch_size=None,
+                          algorithm='rmvpe'):
+    rmvpe = load_rmvpe(algorithm)
+    f0s = rmvpe.infer_from_audio_batch(wav_datas, sample_rate=audio_sample_rate, batch_size=batch_size)
     time_step = hop_size / audio_sample_rate
-    length = (wav_data.shape[0] + hop_size - 1) // hop_size
-    f0_res = resample_align_curve(f0, 0.01, time_step, length)
-    uv_res = resample_align_curve(uv.astype(np.float32), 0.01, time_step, length) > 0.5
+    # Post-process all tracks at once on a concatenated buffer
+    f0, offsets = f0_batch.pack(f0s)
+    f0, uv = f0_batch.interp_f0_batch(f0, offsets, f0 == 0)
+    lengths = [(wav_data.shape[0] + hop_size - 1) // hop_size for wav_data in wav_datas]
+    f0_res, res_offsets = f0_batch.resample_align_batch(f0, offsets, 0.01, time_step, lengths)
+    uv_res = f0_batch.resample_align_batch(uv.astype(np.float32), offsets, 0.01, time_step, lengths)[0] > 0.5
     if not interp_uv:
         f0_res[uv_res] = 0
-    return time_step, f0_res, uv_res
+    return [
+        (time_step, f0_item, uv_item)
+        for f0_item, uv_item in zip(f0_batch.unpack(f0_res, res_offsets), f0_batch.unpack(uv_res, res_offsets))
+    ]
 
 
 def get_pitch(algorithm, wav_data, hop_size, audio_sample_rate, interp_uv=True):
     if algorithm == 'parselmouth':
         return get_pitch_parselmouth(wav_data, hop_size, audio_sample_rate, interp_uv=interp_uv)
-    elif algorithm == 'rmvpe':
-        return get_pitch_rmvpe(wav_data, hop_size, audio_sample_rate, interp_uv=interp_uv)
+    elif algorithm == 'yin':
+        return get_pitch_yin(wav_data, hop_size, audio_sample_rate, interp_uv=interp_uv)
+    elif algorithm in RMVPE_ALGORITHMS:
+        return get_pitch_rmvpe(wav_data, hop_size, audio_sample_rate, interp_uv=interp_uv, algorithm=algorithm)
     else:
         raise ValueError(f" [x] Unknown f0 extractor: {algorithm}")
+
+
+def get_pitch_batch(algorithm, wav_datas, hop_size, audio_sample_rate, interp_uv=True, batch_size=None):
+    if algorithm == 'parselmouth':
+        return get_pitch_parselmouth_batch(wav_datas, hop_size, audio_sample_rate, interp_uv=interp_uv)
+    elif algorithm == 'yin':
+        return get_pitch_yin_batch(wav_datas, hop_size, audio_sample_rate, interp_uv=interp_uv)
+    elif algorithm in RMVPE_ALGORITHMS:
+        return get_pitch_rmvpe_batch(
+            wav_datas, hop_size, audio_sample_rate, interp_uv=interp_uv, batch_size=batch_size, algorithm=algorithm
+        )
+    return [
+        get_pitch(algorithm, wav_data, hop_size, audio_sample_rate, interp_uv=interp_uv)
+        for wav_data in wav_datas
+    ]
+
+
+def get_pitch_from_files(
+        algorithm, wav_paths, hop_size, audio_sample_rate, interp_uv=True,
+        batch_size=None, cache: DiskCache = None, audio_cache: AudioCache = None
+):
+    results = [None] * len(wav_paths)
+    keys = [None] * len(wav_paths)
+    if cache is not None:
+        res_type = default_resampler()
+        for i, wav_path in enumerate(wav_paths):
+            keys[i] = make_key(
+                'pitch', hash_file(wav_path), algorithm, hop_size, audio_sample_rate, interp_uv, res_type
+            )
+            cached = cache.get(keys[i], ('f0', 'uv'))
+            if cached is not None:
+                f0, uv = cached
+                results[i] = (hop_size / audio_sample_rate, f0, uv)
+    missing = [i for i in range(len(wav_paths)) if results[i] is None]
+    if not missing:
+        return results
+    # Hand over to pitch_daemon.py if PITCH_DAEMON_SOCKET is set, which keeps the models loaded between runs
+    from pitch_daemon import connect_daemon, request_pitch_batch, request_pitch_from_files
+    sock = connect_daemon()
+    if sock is not None and audio_cache is None:
+        computed = request_pitch_from_files(
+            sock, algorithm, [wav_paths[i] for i in missing], hop_size, audio_sample_rate,
+            interp_uv=interp_uv, batch_size=batch_size
+        )
+    else:
+        wav_datas = [load_audio(wav_paths[i], sr=audio_sample_rate, cache=audio_cache)[0] for i in missing]
+        if sock is not None:
+            # Decoded waveforms are already at hand, so the daemon does not need to decode the files again
+            computed = request_pitch_batch(
+                sock, algorithm, wav_datas, hop_size, audio_sample_rate, interp_uv=interp_uv, batch_size=batch_size
+            )
+        else:
+            computed = get_pitch_batch(
+                algorithm, wav_datas, hop_size, audio_sample_rate, interp_uv=interp_uv, batch_size=batch_size
+            )
+    for i, result in zip(missing, computed):
+        results[i] = result
+        if cache is not None:
+            _, f0, uv = result
+            cache.put(keys[i], f0=f0, uv=uv)
+    return results
+
+
+def get_pitch_from_file(algorithm, wav_path, hop_size, audio_sample_rate, interp_uv=True,
+                        cache: DiskCache = None, audio_cache: AudioCache = None):
+    return get_pitch_from_files(
+        algorithm, [wav_path], hop_size, audio_sample_rate, interp_uv=interp_uv, batch_size=1,
+        cache=cache, audio_cache=audio_cache
+    )[0]
+
+
+def iter_pitch_from_files(
+        algorithm, wav_paths, hop_size, audio_sample_rate, interp_uv=True,
+        batch_size=None, cache: DiskCache = None, audio_cache: AudioCache = None, chunk_size=64
+):
+    # Load and extract files chunk by chunk so that memory usage does not grow with the dataset
+    if audio_cache is not None:
+        audio_cache.reserve(wav_paths, [audio_sample_rate])
+    for i in range(0, len(wav_paths), chunk_size):
+        yield from get_pitch_from_files(
+            algorithm, wav_paths[i: i + chunk_size], hop_size, audio_sample_rate, interp_uv=interp_uv,
+            batch_size=batch_size, cache=cache, audio_cache=audio_cache
+        )
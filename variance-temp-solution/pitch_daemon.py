@@ -0,0 +1,296 @@
+import functools
+import hashlib
+import json
+import os
+import pathlib
+import signal
+import socket
+import socketserver
+import struct
+import sys
+import tempfile
+import threading
+
+import click
+import numpy as np
+
+from resampler import default_resampler
+
+
+def default_socket_path():
+    # In a directory only accessible by the user, so that no one else can connect or replace the socket
+    uid = os.getuid() if hasattr(os, 'getuid') else 0
+    return os.environ.get(
+        'PITCH_DAEMON_SOCKET', os.path.join(tempfile.gettempdir(), f'makediffsinger-{uid}', 'pitch.sock')
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def daemon_fingerprint():
+    """
+    Digest of the code and model files that pitch extraction depends on, computed once per process. Clients only
+    use a daemon reporting the same fingerprint, so results never come from a daemon started from another version.
+    """
+    root = pathlib.Path(__file__).parent
+    digest = hashlib.blake2b(digest_size=16)
+    for path in sorted([*root.glob('*.py'), *(root / 'rmvpe').glob('*.py')]):
+        digest.update(path.name.encode('utf8'))
+        digest.update(path.read_bytes())
+    for path in sorted((root / 'assets' / 'rmvpe').glob('*')):
+        stat = path.stat()
+        digest.update(f'{path.name}:{stat.st_size}:{stat.st_mtime_ns}'.encode('utf8'))
+    return digest.hexdigest()
+
+
+def _recv_exact(sock, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    pos = 0
+    while pos < size:
+        n = sock.recv_into(view[pos:])
+        if n == 0:
+            raise ConnectionError('Connection to the pitch daemon closed unexpectedly')
+        pos += n
+    return buffer
+
+
+def send_message(sock, header, arrays=()):
+    # An 8-byte length, a JSON header describing the arrays, then the raw data of each array
+    arrays = [np.ascontiguousarray(a) for a in arrays]
+    header = dict(header, arrays=[{'dtype': a.dtype.str, 'shape': list(a.shape)} for a in arrays])
+    data = json.dumps(header).encode('utf8')
+    sock.sendall(struct.pack('<Q', len(data)) + data)
+    for a in arrays:
+        sock.sendall(a.data.cast('B'))
+
+
+def recv_message(sock):
+    size, = struct.unpack('<Q', _recv_exact(sock, 8))
+    header = json.loads(_recv_exact(sock, size))
+    arrays = []
+    for spec in header.pop('arrays'):
+        dtype = np.dtype(spec['dtype'])
+        nbytes = int(np.prod(spec['shape'])) * dtype.itemsize
+        arrays.append(np.frombuffer(_recv_exact(sock, nbytes), dtype=dtype).reshape(spec['shape']))
+    return header, arrays
+
+
+def _connect(socket_path):
+    if not hasattr(socket, 'AF_UNIX') or not os.path.exists(socket_path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+
+def _peer_uid(sock, socket_path):
+    if hasattr(socket, 'SO_PEERCRED'):
+        _, uid, _ = struct.unpack('3i', sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i')))
+        return uid
+    return os.stat(socket_path).st_uid
+
+
+# Socket paths that could not be used, so that they are tried and warned about once per process
+failed_daemons = set()
+
+
+def connect_daemon(socket_path=None):
+    """
+    Connect to the pitch daemon at socket_path, or at PITCH_DAEMON_SOCKET if not given. Using the daemon is
+    opt-in: returns None if neither is set, if there is no daemon, or if the daemon is run by another user
+    or from another version of the code or models.
+    """
+    socket_path = socket_path or os.environ.get('PITCH_DAEMON_SOCKET')
+    if not socket_path or socket_path in failed_daemons:
+        return None
+    sock = _connect(socket_path)
+    if sock is None:
+        failed_daemons.add(socket_path)
+        print(f'Warning: no pitch daemon is running on {socket_path}; extracting pitch locally.')
+        return None
+    if hasattr(os, 'getuid') and _peer_uid(sock, socket_path) != os.getuid():
+        sock.close()
+        failed_daemons.add(socket_path)
+        print(f'Warning: the pitch daemon on {socket_path} is run by another user; extracting pitch locally.')
+        return None
+    fingerprint = daemon_fingerprint()
+    try:
+        send_message(sock, {'hello': fingerprint})
+        response, _ = recv_message(sock)
+    except (OSError, ValueError):
+        response = {}
+    if response.get('fingerprint') != fingerprint:
+        sock.close()
+        failed_daemons.add(socket_path)
+        print(f'Warning: the pitch daemon on {socket_path} runs different code or models; '
+              f'extracting pitch locally. Restart the daemon to use it again.')
+        return None
+    return sock
+
+
+def _request(sock, request):
+    with sock:
+        send_message(sock, request)
+        response, arrays = recv_message(sock)
+    if 'error' in response:
+        raise RuntimeError(f'Pitch daemon failed: {response["error"]}')
+    return [
+        (time_step, arrays[2 * i], arrays[2 * i + 1])
+        for i, time_step in enumerate(response['time_steps'])
+    ]
+
+
+def request_pitch_from_files(sock, algorithm, wav_paths, hop_size, audio_sample_rate, interp_uv=True,
+                             batch_size=None):
+    return _request(sock, {
+        'algorithm': algorithm,
+        'paths': [str(pathlib.Path(p).resolve()) for p in wav_paths],
+        'res_type': default_resampler(),
+        'hop_size': hop_size,
+        'sample_rate': audio_sample_rate,
+        'interp_uv': interp_uv,
+        'batch_size': batch_size,
+    })
+
+
+def request_pitch_batch(sock, algorithm, wav_datas, hop_size, audio_sample_rate, interp_uv=True, batch_size=None):
+    # Waveforms are passed through shared memory instead of the socket
+    from multiprocessing import shared_memory
+    buffers = []
+    try:
+        for wav_data in wav_datas:
+            wav_data = np.asarray(wav_data, dtype=np.float32)
+            shm = shared_memory.SharedMemory(create=True, size=max(wav_data.nbytes, 1))
+            buffers.append((shm, wav_data.shape[0]))
+            np.ndarray(wav_data.shape, dtype=np.float32, buffer=shm.buf)[:] = wav_data
+        return _request(sock, {
+            'algorithm': algorithm,
+            'buffers': [{'name': shm.name, 'length': length} for shm, length in buffers],
+            'hop_size': hop_size,
+            'sample_rate': audio_sample_rate,
+            'interp_uv': interp_uv,
+            'batch_size': batch_size,
+        })
+    finally:
+        for shm, _ in buffers:
+            shm.close()
+            shm.unlink()
+
+
+def _read_shared_memory(name, length):
+    from multiprocessing import resource_tracker, shared_memory
+    shm = shared_memory.SharedMemory(name=name)
+    # The client owns the segment; do not let the tracker of the daemon unlink it
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    try:
+        return np.ndarray((length,), dtype=np.float32, buffer=shm.buf).copy()
+    finally:
+        shm.close()
+
+
+class PitchRequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        try:
+            hello, _ = recv_message(self.request)
+            if 'hello' not in hello:
+                send_message(self.request, {'error': 'Expected a handshake first'})
+                return
+            send_message(self.request, {'fingerprint': self.server.fingerprint})
+            if hello['hello'] != self.server.fingerprint:
+                return
+            request, _ = recv_message(self.request)
+        except ConnectionError:
+            # A client only checking whether the daemon is running
+            return
+        try:
+            results = self.server.extract(request)
+        except Exception as e:
+            send_message(self.request, {'error': f'{type(e).__name__}: {e}'})
+            return
+        send_message(
+            self.request, {'time_steps': [time_step for time_step, _, _ in results]},
+            [a for _, f0, uv in results for a in (f0, uv)]
+        )
+
+
+class PitchDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path):
+        super().__init__(socket_path, PitchRequestHandler)
+        os.chmod(socket_path, 0o600)
+        self.fingerprint = daemon_fingerprint()
+        # Model instances are not thread-safe, so requests to the same extractor are serialized
+        self.locks = {}
+
+    def extract(self, request):
+        from get_pitch import get_pitch_batch
+        from resampler import load
+
+        sample_rate = request['sample_rate']
+        if 'paths' in request:
+            # Resample with the backend chosen by the client
+            wav_datas = [load(p, sr=sample_rate, res_type=request['res_type'])[0] for p in request['paths']]
+        else:
+            wav_datas = [_read_shared_memory(b['name'], b['length']) for b in request['buffers']]
+        with self.locks.setdefault(request['algorithm'], threading.Lock()):
+            return get_pitch_batch(
+                request['algorithm'], wav_datas, request['hop_size'], sample_rate,
+                interp_uv=request['interp_uv'], batch_size=request['batch_size']
+            )
+
+
+def make_socket_dir(socket_path):
+    # The socket is created with the default permissions before it can be restricted, so its directory must
+    # already keep other users out
+    socket_dir = os.path.dirname(os.path.abspath(socket_path))
+    os.makedirs(socket_dir, mode=0o700, exist_ok=True)
+    stat = os.stat(socket_dir)
+    if hasattr(os, 'getuid') and (stat.st_uid != os.getuid() or stat.st_mode & 0o077):
+        raise click.ClickException(
+            f'The socket directory {socket_dir} must be owned by the current user and not accessible by others.'
+        )
+
+
+@click.command(help='Keep pitch extractors loaded and serve pitch extraction over a Unix domain socket. '
+                    'estimate_midi.py, convert_ds.py and correct_cents.py send their requests to it '
+                    'when the PITCH_DAEMON_SOCKET environment variable is set to its socket path.')
+@click.option('--socket', 'socket_path', metavar='PATH', default=default_socket_path(), show_default=True,
+              help='Socket path, in a directory only accessible by the current user '
+                   '(defaults to the PITCH_DAEMON_SOCKET environment variable if set)')
+@click.option('--preload', metavar='ALGORITHM', multiple=True, default=['rmvpe'], show_default=True,
+              help='Pitch extractors to load on start (can be repeated)')
+def pitch_daemon(socket_path, preload):
+    from get_pitch import RMVPE_ALGORITHMS, load_rmvpe
+
+    if not hasattr(socket, 'AF_UNIX'):
+        raise click.ClickException('Unix domain sockets are not supported on this platform.')
+    make_socket_dir(socket_path)
+    if os.path.exists(socket_path):
+        sock = _connect(socket_path)
+        if sock is not None:
+            sock.close()
+            raise click.ClickException(f'A pitch daemon is already running on {socket_path}.')
+        os.unlink(socket_path)
+    for algorithm in preload:
+        if algorithm in RMVPE_ALGORITHMS:
+            load_rmvpe(algorithm)
+    # Also clean up the socket when stopped with kill
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    with PitchDaemon(socket_path) as server:
+        print(f'Serving pitch extraction on {socket_path}')
+        print(f'Set PITCH_DAEMON_SOCKET={socket_path} for the scripts to use this daemon.')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.unlink(socket_path)
+
+
+if __name__ == '__main__':
+    pitch_daemon()
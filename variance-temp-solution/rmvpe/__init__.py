@@ -1 +1,6 @@
-from .inference import RMVPE
+def __getattr__(name):
+    # Import lazily so that the exported runtimes can be used without importing torch
+    if name == 'RMVPE':
+        from .inference import RMVPE
+        return RMVPE
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
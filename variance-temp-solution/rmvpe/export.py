@@ -0,0 +1,84 @@
+import inspect
+import json
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch import nn
+
+from .constants import *
+from .fingerprint import SOURCE_KEY, checkpoint_fingerprint
+from .flat import save_flat_weights
+from .inference import RMVPE
+
+
+class E2E0WithMel(nn.Module):
+    """
+    E2E0 with the mel front-end folded in, taking 16 kHz audio padded as in RMVPE.infer_from_audio.
+    The STFT is expressed as a strided convolution over a windowed DFT basis so that the graph
+    only contains operators that both ONNX and TorchScript can optimize.
+    """
+
+    def __init__(self, model, mel_extractor):
+        super().__init__()
+        self.model = model
+        self.n_fft = mel_extractor.n_fft
+        self.hop_length = mel_extractor.hop_length
+        self.clamp = mel_extractor.clamp
+        window = torch.hann_window(mel_extractor.win_length)
+        window = F.pad(window, ((self.n_fft - mel_extractor.win_length) // 2,) * 2)
+        k = torch.arange(self.n_fft // 2 + 1)[:, None].float()
+        n = torch.arange(self.n_fft)[None, :].float()
+        angle = 2 * np.pi * k * n / self.n_fft
+        dft_basis = torch.cat((torch.cos(angle) * window, -torch.sin(angle) * window))[:, None, :]
+        self.register_buffer('dft_basis', dft_basis)
+        self.register_buffer('mel_basis', mel_extractor.mel_basis)
+
+    def forward(self, audio):
+        audio = F.pad(audio.unsqueeze(1), (self.n_fft // 2, self.n_fft // 2), mode='reflect')
+        spec = F.conv1d(audio, self.dft_basis, stride=self.hop_length)
+        real, imag = spec.chunk(2, dim=1)
+        magnitude = torch.sqrt(real ** 2 + imag ** 2)
+        mel = torch.log(torch.clamp(torch.matmul(self.mel_basis, magnitude), min=self.clamp))
+        return self.model(mel)
+
+
+def build_export_module(model_path):
+    rmvpe = RMVPE(model_path)
+    module = E2E0WithMel(rmvpe.model.cpu(), rmvpe.mel_extractor.cpu()).eval()
+    example = torch.zeros(1, rmvpe.seg_length * 4 - rmvpe.hop_length)
+    return module, example
+
+
+@torch.no_grad()
+def export_onnx(model_path, save_path, opset_version=17):
+    module, example = build_export_module(model_path)
+    kwargs = {}
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        # The dynamo-based exporter cannot trace nn.GRU
+        kwargs['dynamo'] = False
+    torch.onnx.export(
+        module, (example,), str(save_path),
+        input_names=['audio'], output_names=['hidden'],
+        dynamic_axes={'audio': {0: 'batch', 1: 'samples'}, 'hidden': {0: 'batch', 1: 'frames'}},
+        opset_version=opset_version, **kwargs
+    )
+    # Record the checkpoint in the model metadata so that stale exports can be detected
+    import onnx
+    model = onnx.load(str(save_path))
+    entry = model.metadata_props.add()
+    entry.key = SOURCE_KEY
+    entry.value = json.dumps(checkpoint_fingerprint(model_path))
+    onnx.save(model, str(save_path))
+
+
+@torch.no_grad()
+def export_jit(model_path, save_path):
+    module, example = build_export_module(model_path)
+    traced = torch.jit.freeze(torch.jit.trace(module, example))
+    torch.jit.save(traced, str(save_path), _extra_files={SOURCE_KEY: json.dumps(checkpoint_fingerprint(model_path))})
+
+
+def export_weights(model_path, save_path):
+    rmvpe = RMVPE(model_path)
+    save_flat_weights(rmvpe.model.cpu().state_dict(), save_path, source=checkpoint_fingerprint(model_path))
@@ -0,0 +1,33 @@
+import hashlib
+import os
+
+# Entry describing the checkpoint an exported model was made from
+SOURCE_KEY = '__source__'
+
+
+def checkpoint_fingerprint(checkpoint_path, with_hash=True):
+    stat = os.stat(checkpoint_path)
+    fingerprint = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    if with_hash:
+        h = hashlib.blake2b(digest_size=20)
+        with open(checkpoint_path, 'rb') as f:
+            while chunk := f.read(1 << 20):
+                h.update(chunk)
+        fingerprint['blake2b'] = h.hexdigest()
+    return fingerprint
+
+
+def matches_checkpoint(source, checkpoint_path):
+    """
+    Whether a fingerprint recorded at export time describes the checkpoint as it is now. Size and modification
+    time are compared first; the content hash decides if they differ (e.g. the checkpoint was copied).
+    Missing fingerprints never match.
+    """
+    if source is None:
+        return False
+    fingerprint = checkpoint_fingerprint(checkpoint_path, with_hash=False)
+    if fingerprint['size'] != source['size']:
+        return False
+    if fingerprint['mtime_ns'] == source['mtime_ns']:
+        return True
+    return checkpoint_fingerprint(checkpoint_path)['blake2b'] == source['blake2b']
@@ -0,0 +1,102 @@
+import json
+import mmap
+import warnings
+
+import numpy as np
+import torch
+
+from .fingerprint import SOURCE_KEY, matches_checkpoint
+
+MAGIC = b'RMVPEFW1'
+ALIGNMENT = 64
+
+
+def _align(size):
+    return (size + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _dim_order(tensor):
+    # Dimensions from the outermost to the innermost in memory, e.g. (0, 2, 3, 1) for channels-last
+    return sorted(range(tensor.dim()), key=lambda d: (-tensor.stride(d), d))
+
+
+def save_flat_weights(state_dict, save_path, source=None):
+    """
+    Save a state dict as a flat file that can be memory-mapped: an 8-byte magic, the size of a JSON header,
+    the JSON header, then the raw data of every tensor aligned to 64 bytes in its own memory order.
+    :param source: fingerprint of the checkpoint the state dict comes from, see fingerprint.checkpoint_fingerprint
+    """
+    header = {}
+    blobs = []
+    offset = 0
+    for name, tensor in state_dict.items():
+        tensor = tensor.detach().cpu()
+        order = _dim_order(tensor)
+        data = tensor.permute(order).contiguous().numpy().tobytes()
+        header[name] = {
+            'dtype': str(tensor.dtype).replace('torch.', ''),
+            'shape': list(tensor.shape),
+            'dim_order': order,
+            'offset': offset,
+        }
+        blobs.append(data)
+        offset += _align(len(data))
+    if source is not None:
+        header[SOURCE_KEY] = source
+    header_bytes = json.dumps(header).encode('utf8')
+    data_start = _align(len(MAGIC) + 8 + len(header_bytes))
+    header_bytes = header_bytes.ljust(data_start - len(MAGIC) - 8)
+    with open(save_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(len(header_bytes).to_bytes(8, 'little'))
+        f.write(header_bytes)
+        for info, data in zip(header.values(), blobs):
+            f.seek(data_start + info['offset'])
+            f.write(data)
+
+
+def _read_header(model_path):
+    with open(model_path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'Not a flat RMVPE weight file: {model_path}')
+        header_size = int.from_bytes(f.read(8), 'little')
+        return json.loads(f.read(header_size))
+
+
+def exported_from(model_path, checkpoint_path):
+    """
+    Whether the flat weight file was exported from the checkpoint as it is now, see matches_checkpoint.
+    """
+    return matches_checkpoint(_read_header(model_path).get(SOURCE_KEY), checkpoint_path)
+
+
+def load_flat_weights(model_path):
+    """
+    Map a file written by save_flat_weights read-only and return a state dict of tensors viewing the mapping,
+    so that all processes loading the same file share the physical pages of the weights.
+    The tensors must not be modified in place.
+    """
+    with open(model_path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'Not a flat RMVPE weight file: {model_path}')
+        header_size = int.from_bytes(f.read(8), 'little')
+        header = json.loads(f.read(header_size))
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    data_start = len(MAGIC) + 8 + header_size
+    state_dict = {}
+    with warnings.catch_warnings():
+        # torch warns about views of non-writable buffers
+        warnings.simplefilter('ignore', UserWarning)
+        for name, info in header.items():
+            if name == SOURCE_KEY:
+                continue
+            dtype = getattr(torch, info['dtype'])
+            order = info['dim_order']
+            shape = [info['shape'][d] for d in order]
+            count = int(np.prod(shape))
+            if count == 0:
+                tensor = torch.empty(shape, dtype=dtype)
+            else:
+                tensor = torch.frombuffer(buffer, dtype=dtype, count=count, offset=data_start + info['offset'])
+            state_dict[name] = tensor.view(shape).permute(np.argsort(order).tolist())
+    return state_dict
@@ -0,0 +1,39 @@
+import copy
+
+import torch
+from torch import nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+
+
+@torch.no_grad()
+def freeze_model(model):
+    """
+    Prepare an E2E0 model in eval mode for inference only:
+    - fold every BatchNorm2d that directly follows a bias-less convolution into the convolution;
+    - replace Dropout with Identity;
+    - convert the convolutional part to channels-last memory format.
+    The BatchNorm2d at the input of the encoder is kept because the following convolution
+    zero-pads its output, which cannot be expressed by folding.
+    A model on the meta device only gets the structure of the frozen model.
+    """
+    for module in model.modules():
+        if not isinstance(module, nn.Sequential):
+            continue
+        for i in range(len(module)):
+            if isinstance(module[i], nn.Dropout):
+                module[i] = nn.Identity()
+            elif i > 0 and isinstance(module[i], nn.BatchNorm2d) \
+                    and isinstance(module[i - 1], (nn.Conv2d, nn.ConvTranspose2d)):
+                if module[i - 1].weight.is_meta:
+                    # Only build the structure, the frozen weights are loaded afterwards
+                    fused = copy.deepcopy(module[i - 1])
+                    fused.bias = nn.Parameter(torch.empty_like(module[i].running_mean))
+                else:
+                    fused = fuse_conv_bn_eval(
+                        module[i - 1], module[i], transpose=isinstance(module[i - 1], nn.ConvTranspose2d)
+                    )
+                module[i - 1] = fused
+                module[i] = nn.Identity()
+    model.unet.to(memory_format=torch.channels_last)
+    model.cnn.to(memory_format=torch.channels_last)
+    return model
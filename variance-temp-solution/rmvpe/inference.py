@@ -1,25 +1,97 @@
+import copy
+import threading
+import time
+import warnings
+
+import numpy as np
 import torch
 import torch.nn.functional as F
 from torchaudio.transforms import Resample
 
 from .constants import *
+from .flat import load_flat_weights
+from .freeze import freeze_model
 from .model import E2E0
 from .spec import MelSpectrogram
-from .utils import to_local_average_f0, to_viterbi_f0
+from .quantize import quantize_dynamic, quantize_static
+from .utils import cents_error, make_calibration_audio, to_local_average_f0, to_viterbi_f0, voicing_agreement
 
 
 class RMVPE:
-    def __init__(self, model_path, hop_length=160):
+    def __init__(self, model_path, hop_length=160, chunk_frames=8192, context_frames=1440, quantize=None,
+                 precision='float32', max_cents_error=5., silence_threshold=None, min_silence_frames=192,
+                 gate_context_frames=32):
         self.resample_kernel = {}
-        self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        self.model = E2E0(4, 1, (2, 2)).eval().to(self.device)
-        ckpt = torch.load(model_path, map_location=self.device)
-        self.model.load_state_dict(ckpt['model'], strict=False)
+        # Inference may run from several threads at once (see RMVPEPool); guard the lazily built state
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        # Quantized kernels are only available on CPU
+        self.device = 'cuda' if torch.cuda.is_available() and quantize is None else 'cpu'
+        if str(model_path).endswith('.weights'):
+            # Frozen weights written by export_rmvpe.py, mapped from the file instead of copied
+            with torch.device('meta'):
+                self.model = freeze_model(E2E0(4, 1, (2, 2)).eval())
+            self.model.load_state_dict(load_flat_weights(model_path), assign=True)
+            self.model = self.model.requires_grad_(False).to(self.device)
+        else:
+            self.model = E2E0(4, 1, (2, 2)).eval().to(self.device)
+            ckpt = torch.load(model_path, map_location=self.device)
+            self.model.load_state_dict(ckpt['model'], strict=False)
+            self.model = freeze_model(self.model)
         self.hop_length = hop_length
         self.seg_length = 32 * hop_length
+        self.batch_size = None
+        # Long inputs are processed in chunks with enough context on both sides to cover the receptive field
+        # of the U-Net; both values must be multiples of 32 to keep the pooling grid aligned.
+        assert chunk_frames % 32 == 0 and context_frames % 32 == 0
+        self.chunk_frames = chunk_frames
+        self.context_frames = context_frames
+        # Silence gate: runs of at least min_silence_frames frames below silence_threshold dBFS are skipped
+        # and decoded as unvoiced; the remaining spans only get gate_context_frames of context on both sides.
+        assert min_silence_frames % 32 == 0 and gate_context_frames % 32 == 0
+        self.silence_threshold = silence_threshold
+        self.min_silence_frames = min_silence_frames
+        self.gate_context_frames = gate_context_frames
         self.mel_extractor = MelSpectrogram(
             N_MELS, SAMPLE_RATE, WINDOW_LENGTH, hop_length, None, MEL_FMIN, MEL_FMAX
         ).to(self.device)
+        float_model = self.model
+        if quantize == 'dynamic':
+            self.model = quantize_dynamic(self.model)
+        elif quantize == 'static':
+            audio = torch.from_numpy(make_calibration_audio()).unsqueeze(0)
+            audio = F.pad(audio, (0, self.padded_length(audio.shape[1]) - audio.shape[1]))
+            # The U-Net is converted in place
+            self.model = quantize_static(copy.deepcopy(self.model), [self.mel_extractor(audio)])
+        elif quantize is not None:
+            raise ValueError(f'Unknown quantization mode: {quantize}')
+        self.quantize = quantize
+        if precision not in ('float32', 'bfloat16'):
+            raise ValueError(f'Unknown precision: {precision}')
+        self.precision = precision
+        if (quantize is not None or precision != 'float32') and max_cents_error is not None:
+            self.check_precision(float_model, max_cents_error=max_cents_error)
+
+    def check_precision(self, float_model, max_cents_error=5., min_voicing_agreement=0.99):
+        # Compare against float32 on a synthetic clip and fall back to float32 if the results drift too far
+        audio = make_calibration_audio()
+        model, precision = self.model, self.precision
+        self.model, self.precision = float_model, 'float32'
+        ref_f0 = self._infer_batch([audio], SAMPLE_RATE)[0]
+        self.model, self.precision = model, precision
+        f0 = self._infer_batch([audio], SAMPLE_RATE)[0]
+        cents = cents_error(ref_f0, f0)
+        p95_cents = np.percentile(cents, 95) if len(cents) > 0 else 0.
+        agreement = voicing_agreement(ref_f0, f0)
+        if p95_cents > max_cents_error or agreement < min_voicing_agreement:
+            mode = f'{self.quantize} int8' if self.quantize is not None else precision
+            warnings.warn(
+                f'RMVPE in {mode} deviates from float32 (p95 {p95_cents:.2f} cents, '
+                f'voicing agreement {agreement:.2%}); falling back to float32.'
+            )
+            self.model, self.precision, self.quantize = float_model, 'float32', None
+            return False
+        return True
 
     @torch.no_grad()
     def mel2hidden(self, mel):
@@ -28,30 +100,221 @@ class RMVPE:
         hidden = self.model(mel)
         return hidden[:, :n_frames]
 
+    @property
+    def skipped_fractions(self):
+        # Fraction of model frames skipped by the silence gate for each input of the last call in this thread
+        return getattr(self._local, 'skipped_fractions', [])
+
+    @skipped_fractions.setter
+    def skipped_fractions(self, value):
+        self._local.skipped_fractions = value
+
+    def forward(self, mel, lengths=None):
+        with torch.no_grad(), torch.autocast(
+                self.device, dtype=torch.bfloat16, enabled=self.precision == 'bfloat16'
+        ):
+            return self.model(mel, lengths=lengths).float()
+
+    def padded_length(self, n_samples):
+        T1 = n_samples + self.hop_length
+        return self.seg_length * ((T1 - 1) // self.seg_length + 1) - self.hop_length
+
+    def bucket_length(self, n_samples):
+        # The padded length rounded up to a grid of 4 to 8 steps per octave, so that inputs of similar lengths
+        # are batched together with at most 25% of padding
+        n_segments = int(self.padded_length(n_samples) + self.hop_length) // self.seg_length
+        step = 1 << max(n_segments.bit_length() - 3, 0)
+        return self.seg_length * ((n_segments - 1) // step + 1) * step - self.hop_length
+
     def decode(self, hidden, thred=0.03, use_viterbi=False):
+        hidden = hidden.cpu().numpy()
         if use_viterbi:
             f0 = to_viterbi_f0(hidden, thred=thred)
         else:
             f0 = to_local_average_f0(hidden, thred=thred)
         return f0
 
-    def infer_from_audio(self, audio, sample_rate=16000, thred=0.03, use_viterbi=False):
-        audio = torch.from_numpy(audio).float().unsqueeze(0).to(self.device)
+    def resample(self, audio, sample_rate):
         if sample_rate == 16000:
-            audio_res = audio
-        else:
-            key_str = str(sample_rate)
+            return audio
+        key_str = str(sample_rate)
+        with self._lock:
             if key_str not in self.resample_kernel:
-                self.resample_kernel[key_str] = Resample(sample_rate, 16000, lowpass_filter_width=128)
-            self.resample_kernel[key_str] = self.resample_kernel[key_str].to(self.device)
-            audio_res = self.resample_kernel[key_str](audio)
-        B, T = audio_res.shape
-        n_frames = T // self.hop_length + 1 
-        T1 = T + self.hop_length
-        T_pad = self.seg_length * ((T1 - 1) // self.seg_length + 1) - T1
-        audio_res = F.pad(audio_res, (0, T_pad))
-        mel = self.mel_extractor(audio_res, center=True)
-        with torch.no_grad():
-            hidden = self.model(mel)
-        f0 = self.decode(hidden[:, :n_frames], thred=thred, use_viterbi=use_viterbi)
+                self.resample_kernel[key_str] = Resample(sample_rate, 16000, lowpass_filter_width=128).to(self.device)
+        return self.resample_kernel[key_str](audio)
+
+    def infer_from_audio(self, audio, sample_rate=16000, thred=0.03, use_viterbi=False):
+        return self.infer_from_audio_batch(
+            [audio], sample_rate=sample_rate, thred=thred, use_viterbi=use_viterbi, batch_size=1
+        )[0]
+
+    def infer_from_audio_batch(self, audios, sample_rate=16000, thred=0.03, use_viterbi=False, batch_size=None):
+        f0s = [None] * len(audios)
+        self.skipped_fractions = [0.] * len(audios)
+        # Long inputs are streamed one by one to keep peak memory bounded
+        max_samples = self.chunk_frames * self.hop_length * sample_rate // SAMPLE_RATE
+        for i, audio in enumerate(audios):
+            if self.silence_threshold is not None:
+                f0s[i], self.skipped_fractions[i] = self._infer_gated(
+                    audio, sample_rate, thred=thred, use_viterbi=use_viterbi
+                )
+            elif audio.shape[0] > max_samples:
+                f0s[i] = self._infer_chunked(audio, sample_rate, thred=thred, use_viterbi=use_viterbi)
+        # Bucket by length so that each batch is padded as little as possible
+        order = sorted(
+            [i for i in range(len(audios)) if f0s[i] is None], key=lambda i: audios[i].shape[0]
+        )
+        # The batch size is only tuned when something is left to batch, i.e. not with the silence gate
+        if batch_size is None:
+            lengths = [audios[i].shape[0] * SAMPLE_RATE // sample_rate for i in order]
+            batch_size = self.tune_batch_size(lengths) if len(order) > 0 else 1
+        for i in range(0, len(order), batch_size):
+            bucket = order[i: i + batch_size]
+            for idx, f0 in zip(bucket, self._infer_batch(
+                    [audios[idx] for idx in bucket], sample_rate, thred=thred, use_viterbi=use_viterbi
+            )):
+                f0s[idx] = f0
+        return f0s
+
+    def _infer_batch(self, audios, sample_rate, thred=0.03, use_viterbi=False):
+        audios_res = [
+            self.resample(torch.from_numpy(audio).float().unsqueeze(0).to(self.device), sample_rate)
+            for audio in audios
+        ]
+        # Inputs are batched with others of the same bucket length and padded to the longest padded length among
+        # them. The BiGRU only runs over the frames of the padded length of each input, as when it is inferred
+        # alone, so that the extra padding is not carried into its frames.
+        groups = {}
+        for i, audio_res in enumerate(audios_res):
+            groups.setdefault(self.bucket_length(audio_res.shape[1]), []).append(i)
+        f0s = [None] * len(audios)
+        for group in groups.values():
+            T_len = max(self.padded_length(audios_res[i].shape[1]) for i in group)
+            audio_batch = torch.cat([F.pad(audios_res[i], (0, T_len - audios_res[i].shape[1])) for i in group])
+            mel = self.mel_extractor(audio_batch, center=True)
+            lengths = [self.padded_length(audios_res[i].shape[1]) // self.hop_length + 1 for i in group]
+            hidden = self.forward(mel, lengths=lengths if min(lengths) < mel.shape[-1] else None)
+            for j, i in enumerate(group):
+                n_frames = audios_res[i].shape[1] // self.hop_length + 1
+                f0s[i] = self.decode(hidden[j, :n_frames], thred=thred, use_viterbi=use_viterbi)
+        return f0s
+
+    def _infer_chunked(self, audio, sample_rate, thred=0.03, use_viterbi=False):
+        audio_res = self.resample(torch.from_numpy(audio).float().unsqueeze(0).to(self.device), sample_rate)
+        n_frames = audio_res.shape[1] // self.hop_length + 1
+        f0, _ = self._infer_spans(
+            audio_res, [(0, n_frames)], n_frames, self.context_frames, thred=thred, use_viterbi=use_viterbi
+        )
         return f0
+
+    def _infer_gated(self, audio, sample_rate, thred=0.03, use_viterbi=False):
+        audio_res = self.resample(torch.from_numpy(audio).float().unsqueeze(0).to(self.device), sample_rate)
+        n_frames = audio_res.shape[1] // self.hop_length + 1
+        spans = self.active_spans(audio_res[0].cpu().numpy(), n_frames)
+        f0, n_computed = self._infer_spans(
+            audio_res, spans, n_frames, self.gate_context_frames, thred=thred, use_viterbi=use_viterbi
+        )
+        n_mel_frames = self.padded_length(audio_res.shape[1]) // self.hop_length + 1
+        return f0, max(1. - n_computed / n_mel_frames, 0.)
+
+    def active_spans(self, audio_res, n_frames):
+        # RMS of each analysis window (centered on the frame) from a running sum of squares
+        half = WINDOW_LENGTH // 2
+        cumsum = np.concatenate(([0.], np.cumsum(audio_res.astype(np.float64) ** 2)))
+        centers = np.arange(n_frames) * self.hop_length
+        lo = np.clip(centers - half, 0, audio_res.shape[0])
+        hi = np.clip(centers + half, 0, audio_res.shape[0])
+        rms = np.sqrt(np.maximum(cumsum[hi] - cumsum[lo], 0.) / WINDOW_LENGTH)
+        silent = rms < 10 ** (self.silence_threshold / 20)
+        # Only whole 32-frame blocks are skipped to keep the pooling grid of the U-Net aligned
+        n_blocks = (n_frames - 1) // 32 + 1
+        silent = np.pad(silent, (0, n_blocks * 32 - n_frames), constant_values=True)
+        silent_blocks = silent.reshape(n_blocks, 32).all(axis=1)
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], silent_blocks.astype(np.int8), [0]))))
+        spans = []
+        start = 0
+        for run_start, run_end in edges.reshape(-1, 2):
+            # Skipping a run inside the audio splits a span, which costs context on both sides and
+            # another model call; at the edges only one side of context is needed
+            if run_start == 0 or run_end == n_blocks:
+                min_blocks = self.gate_context_frames // 32 + 1
+            else:
+                min_blocks = self.min_silence_frames // 32
+            if run_end - run_start >= min_blocks:
+                if run_start > start:
+                    spans.append((start * 32, run_start * 32))
+                start = run_end
+        if start < n_blocks:
+            spans.append((start * 32, n_frames))
+        return spans
+
+    def _infer_spans(self, audio_res, spans, n_frames, context_frames, thred=0.03, use_viterbi=False):
+        # Run the model on each span (split into chunks) with context on both sides; frames outside
+        # the spans are left as zero salience, i.e. unvoiced
+        T_len = self.padded_length(audio_res.shape[1])
+        n_mel_frames = T_len // self.hop_length + 1
+        if use_viterbi:
+            hidden = np.zeros((1, n_frames, N_CLASS), dtype=np.float32)
+        f0 = np.zeros(n_frames, dtype=np.float32)
+        n_computed = 0
+        for span_start, span_end in spans:
+            for start in range(span_start, span_end, self.chunk_frames):
+                end = min(start + self.chunk_frames, 32 * ((span_end - 1) // 32 + 1), n_mel_frames)
+                ctx_start = max(start - context_frames, 0)
+                ctx_end = min(end + context_frames, n_mel_frames)
+                n_computed += ctx_end - ctx_start
+                mel = self._mel_slice(audio_res, ctx_start, ctx_end, T_len)
+                chunk = self.forward(mel)[:, start - ctx_start: end - ctx_start]
+                chunk = chunk[:, :span_end - start]
+                if use_viterbi:
+                    # Viterbi decoding needs the whole salience sequence
+                    hidden[:, start: start + chunk.shape[1]] = chunk.cpu().numpy()
+                else:
+                    f0[start: start + chunk.shape[1]] = self.decode(chunk[0], thred=thred)
+        if use_viterbi:
+            f0 = to_viterbi_f0(hidden[0], thred=thred)
+        return f0, n_computed
+
+    def _mel_slice(self, audio_res, start, end, T_len):
+        # Mel frames [start, end) exactly as computed on the whole signal zero-padded to T_len samples
+        margin = (WINDOW_LENGTH // 2 + self.hop_length - 1) // self.hop_length
+        s = max(start - margin, 0) * self.hop_length
+        e = min((end - 1 + margin) * self.hop_length, T_len)
+        audio_slice = audio_res[:, s: e]
+        audio_slice = F.pad(audio_slice, (0, e - s - audio_slice.shape[1]))
+        mel = self.mel_extractor(audio_slice, center=True)
+        offset = start - s // self.hop_length
+        return mel[:, :, offset: offset + end - start]
+
+    def tune_batch_size(self, lengths=None, max_batch_size=32, seconds=5.):
+        """
+        Double the batch size until throughput stops improving noticeably. The batch size is tuned once, on the
+        lengths (in samples at 16 kHz) of the first inputs it is asked for, or on clips of the given seconds.
+        """
+        with self._lock:
+            if self.batch_size is None:
+                self.batch_size = self._tune_batch_size(lengths, max_batch_size, seconds)
+        return self.batch_size
+
+    def _tune_batch_size(self, lengths, max_batch_size, seconds):
+        # Batches are made of neighbours in length order around the median, like real batches of sorted inputs;
+        # long inputs are streamed in chunks instead of batched
+        max_samples = self.chunk_frames * self.hop_length
+        lengths = [n for n in lengths or () if 0 < n <= max_samples] or [int(seconds * SAMPLE_RATE)]
+        lengths = sorted(lengths * (max_batch_size // len(lengths) + 1))
+        first = len(lengths) // 2 - max_batch_size // 2
+        noise = np.random.RandomState(0).randn(max(lengths)).astype(np.float32) * 0.1
+        audios = [noise[:n] for n in lengths[first: first + max_batch_size]]
+        self._infer_batch(audios[:1], SAMPLE_RATE)  # warm up
+        best_batch_size, best_throughput = 1, 0.
+        batch_size = 1
+        while batch_size <= max_batch_size:
+            batch = audios[(max_batch_size - batch_size) // 2: (max_batch_size + batch_size) // 2]
+            start = time.perf_counter()
+            self._infer_batch(batch, SAMPLE_RATE)
+            throughput = batch_size / (time.perf_counter() - start)
+            if throughput < best_throughput * 1.05:
+                break
+            best_batch_size, best_throughput = batch_size, throughput
+            batch_size *= 2
+        return best_batch_size
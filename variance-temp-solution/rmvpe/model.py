@@ -25,8 +25,11 @@ class E2E0(nn.Module):
                 nn.Sigmoid()
             )
 
-    def forward(self, mel):
+    def forward(self, mel, lengths=None):
         mel = mel.transpose(-1, -2).unsqueeze(1)
         x = self.cnn(self.unet(mel)).transpose(1, 2).flatten(-2)
-        x = self.fc(x)
+        if lengths is not None and isinstance(self.fc[0], BiGRU):
+            x = self.fc[1:](self.fc[0](x, lengths))
+        else:
+            x = self.fc(x)
         return x
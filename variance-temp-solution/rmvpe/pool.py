@@ -0,0 +1,80 @@
+import threading
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+from .constants import SAMPLE_RATE
+from .runtime import default_num_threads
+
+
+def set_num_interop_threads(num_interop_threads):
+    # The inter-op thread pool can only be sized once, before it is first used
+    try:
+        torch.set_num_interop_threads(num_interop_threads)
+    except RuntimeError as e:
+        warnings.warn(f'Cannot set the number of inter-op threads: {e}')
+
+
+class RMVPEPool:
+    """
+    Run RMVPE inference from num_workers threads at once, each using num_threads intra-op threads.
+    All workers share the same model instance: inference does not modify the frozen weights, and torch
+    releases the GIL inside operators, so the streams run truly in parallel.
+    Keep num_workers * num_threads at most the number of cores to avoid oversubscription.
+    """
+
+    def __init__(self, rmvpe, num_workers=1, num_threads=None):
+        if num_threads is None:
+            num_threads = max(default_num_threads() // num_workers, 1)
+        self.rmvpe = rmvpe
+        self.num_workers = num_workers
+        self.num_threads = num_threads
+        # Threads created by torch itself are initialized from the process-wide setting
+        torch.set_num_threads(num_threads)
+        self.executor = ThreadPoolExecutor(
+            num_workers, thread_name_prefix='rmvpe', initializer=torch.set_num_threads, initargs=(num_threads,)
+        )
+        self._local = threading.local()
+
+    @property
+    def skipped_fractions(self):
+        return getattr(self._local, 'skipped_fractions', [])
+
+    def _infer(self, audios, kwargs):
+        f0s = self.rmvpe.infer_from_audio_batch(audios, **kwargs)
+        return f0s, self.rmvpe.skipped_fractions
+
+    def infer_from_audio(self, audio, sample_rate=16000, thred=0.03, use_viterbi=False):
+        return self.infer_from_audio_batch(
+            [audio], sample_rate=sample_rate, thred=thred, use_viterbi=use_viterbi, batch_size=1
+        )[0]
+
+    def infer_from_audio_batch(self, audios, sample_rate=16000, thred=0.03, use_viterbi=False, batch_size=None):
+        if batch_size is None and self.rmvpe.silence_threshold is not None:
+            # With the silence gate, inputs are inferred one by one anyway
+            batch_size = 1
+        elif batch_size is None:
+            # Tune with the same number of threads as the workers use
+            lengths = [audio.shape[0] * SAMPLE_RATE // sample_rate for audio in audios]
+            batch_size = self.executor.submit(self.rmvpe.tune_batch_size, lengths).result()
+        kwargs = {'sample_rate': sample_rate, 'thred': thred, 'use_viterbi': use_viterbi, 'batch_size': batch_size}
+        # Hand out buckets of similar lengths, longest first, so that the workers finish at about the same time
+        order = sorted(range(len(audios)), key=lambda i: audios[i].shape[0], reverse=True)
+        buckets = [order[i: i + batch_size] for i in range(0, len(order), batch_size)]
+        futures = [
+            self.executor.submit(self._infer, [audios[i] for i in bucket], kwargs)
+            for bucket in buckets
+        ]
+        f0s = [None] * len(audios)
+        skipped_fractions = [0.] * len(audios)
+        for bucket, future in zip(buckets, futures):
+            bucket_f0s, bucket_skipped = future.result()
+            for i, f0, skipped in zip(bucket, bucket_f0s, bucket_skipped):
+                f0s[i] = f0
+                skipped_fractions[i] = skipped
+        self._local.skipped_fractions = skipped_fractions
+        return f0s
+
+    def shutdown(self):
+        self.executor.shutdown()
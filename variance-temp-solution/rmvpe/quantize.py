@@ -0,0 +1,20 @@
+import torch
+from torch import nn
+
+
+def quantize_dynamic(model):
+    # Weights of the BiGRU and Linear layers are stored in int8, activations are quantized on the fly
+    return torch.ao.quantization.quantize_dynamic(model, {nn.GRU, nn.Linear}, dtype=torch.qint8)
+
+
+@torch.no_grad()
+def quantize_static(model, calibration_mels):
+    # The U-Net is quantized with activation ranges observed on the calibration inputs
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+    example = calibration_mels[0].transpose(-1, -2).unsqueeze(1)
+    unet = prepare_fx(model.unet, get_default_qconfig_mapping(), example_inputs=(example,))
+    for mel in calibration_mels:
+        unet(mel.transpose(-1, -2).unsqueeze(1))
+    model.unet = convert_fx(unet)
+    return quantize_dynamic(model)
@@ -0,0 +1,44 @@
+import functools
+import math
+
+import numpy as np
+
+
+@functools.lru_cache(maxsize=None)
+def sinc_resample_kernel(orig_freq, new_freq, lowpass_filter_width=128, rolloff=0.99):
+    """
+    The Hann-windowed sinc kernel of torchaudio.transforms.Resample, computed without torch.
+    :param orig_freq: original rate divided by the GCD of both rates
+    :param new_freq: target rate divided by the GCD of both rates
+    :return: the kernel [new_freq, 2 * width + orig_freq] and the width
+    """
+    base_freq = min(orig_freq, new_freq) * rolloff
+    width = math.ceil(lowpass_filter_width * orig_freq / base_freq)
+    idx = np.arange(-width, width + orig_freq, dtype=np.float64) / orig_freq
+    t = (np.arange(0, -new_freq, -1, dtype=np.float32) / np.float32(new_freq))[:, None] + idx
+    t = np.clip(t * base_freq, -lowpass_filter_width, lowpass_filter_width)
+    window = np.cos(t * math.pi / lowpass_filter_width / 2) ** 2
+    t *= math.pi
+    with np.errstate(invalid='ignore', divide='ignore'):
+        kernel = np.where(t == 0, 1., np.sin(t) / t)
+    kernel *= window * (base_freq / orig_freq)
+    return kernel.astype(np.float32), width
+
+
+def resample(audio, orig_sr, target_sr, lowpass_filter_width=128, block_size=4096):
+    """
+    Resample 1-D audio as RMVPE.resample does with torchaudio, processing block_size strides at a time.
+    """
+    if orig_sr == target_sr:
+        return audio
+    gcd = math.gcd(int(orig_sr), int(target_sr))
+    orig_freq, new_freq = int(orig_sr) // gcd, int(target_sr) // gcd
+    kernel, width = sinc_resample_kernel(orig_freq, new_freq, lowpass_filter_width)
+    length = audio.shape[0]
+    padded = np.pad(audio.astype(np.float32), (width, width + orig_freq))
+    frames = np.lib.stride_tricks.sliding_window_view(padded, kernel.shape[1])[::orig_freq]
+    resampled = np.concatenate([
+        (frames[i: i + block_size] @ kernel.T).reshape(-1)
+        for i in range(0, frames.shape[0], block_size)
+    ])
+    return resampled[:math.ceil(new_freq * length / orig_freq)]
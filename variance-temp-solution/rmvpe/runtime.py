@@ -0,0 +1,92 @@
+import json
+import os
+
+import numpy as np
+
+from .constants import *
+from .fingerprint import SOURCE_KEY
+from .resample import resample
+from .utils import to_local_average_f0, to_viterbi_f0
+
+
+def default_num_threads():
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count()
+
+
+class ExportedRMVPE:
+    """
+    Base class of RMVPE runtimes running a graph exported by export_rmvpe.py.
+    Subclasses take padded 16 kHz audio [B, T] and return the salience [B, N, N_CLASS], and set source
+    to the fingerprint of the checkpoint the graph was exported from (None if it was not recorded).
+    """
+
+    def __init__(self, model_path, hop_length=160, num_threads=None):
+        self.model_path = model_path
+        self.hop_length = hop_length
+        self.seg_length = 32 * hop_length
+        self.num_threads = num_threads if num_threads is not None else default_num_threads()
+        self.source = None
+
+    def forward(self, audio):
+        raise NotImplementedError()
+
+    def decode(self, hidden, thred=0.03, use_viterbi=False):
+        if use_viterbi:
+            f0 = to_viterbi_f0(hidden, thred=thred)
+        else:
+            f0 = to_local_average_f0(hidden, thred=thred)
+        return f0
+
+    def infer_from_audio(self, audio, sample_rate=16000, thred=0.03, use_viterbi=False):
+        if sample_rate != SAMPLE_RATE:
+            audio = resample(audio, sample_rate, SAMPLE_RATE)
+        T = audio.shape[0]
+        n_frames = T // self.hop_length + 1
+        T1 = T + self.hop_length
+        T_pad = self.seg_length * ((T1 - 1) // self.seg_length + 1) - T1
+        audio = np.pad(audio.astype(np.float32), (0, T_pad))
+        hidden = self.forward(audio[None])
+        return self.decode(hidden[0, :n_frames], thred=thred, use_viterbi=use_viterbi)
+
+    def infer_from_audio_batch(self, audios, sample_rate=16000, thred=0.03, use_viterbi=False, batch_size=None):
+        return [
+            self.infer_from_audio(audio, sample_rate=sample_rate, thred=thred, use_viterbi=use_viterbi)
+            for audio in audios
+        ]
+
+
+class RMVPEOnnx(ExportedRMVPE):
+    def __init__(self, model_path, hop_length=160, num_threads=None):
+        super().__init__(model_path, hop_length=hop_length, num_threads=num_threads)
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.intra_op_num_threads = self.num_threads
+        options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(str(model_path), options, providers=['CPUExecutionProvider'])
+        source = self.session.get_modelmeta().custom_metadata_map.get(SOURCE_KEY)
+        if source is not None:
+            self.source = json.loads(source)
+
+    def forward(self, audio):
+        return self.session.run(['hidden'], {'audio': audio})[0]
+
+
+class RMVPEJit(ExportedRMVPE):
+    def __init__(self, model_path, hop_length=160, num_threads=None):
+        super().__init__(model_path, hop_length=hop_length, num_threads=num_threads)
+        import torch
+        self.torch = torch
+        torch.set_num_threads(self.num_threads)
+        extra_files = {SOURCE_KEY: ''}
+        model = torch.jit.load(str(model_path), map_location='cpu', _extra_files=extra_files)
+        self.model = torch.jit.optimize_for_inference(model)
+        if extra_files[SOURCE_KEY]:
+            self.source = json.loads(extra_files[SOURCE_KEY])
+
+    def forward(self, audio):
+        with self.torch.no_grad():
+            return self.model(self.torch.from_numpy(audio)).numpy()
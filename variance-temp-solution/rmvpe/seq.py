@@ -1,4 +1,5 @@
 import torch.nn as nn
+from torch.nn.utils.rnn import pack_padded_sequence, pad_packed_sequence
 
 
 class BiGRU(nn.Module):
@@ -6,5 +7,9 @@ class BiGRU(nn.Module):
         super(BiGRU, self).__init__()
         self.gru = nn.GRU(input_features, hidden_features, num_layers=num_layers, batch_first=True, bidirectional=True)
 
-    def forward(self, x):
-        return self.gru(x)[0]
+    def forward(self, x, lengths=None):
+        # With lengths, the frames beyond the length of each sequence are masked out of both directions
+        if lengths is None:
+            return self.gru(x)[0]
+        packed = pack_padded_sequence(x, lengths, batch_first=True, enforce_sorted=False)
+        return pad_packed_sequence(self.gru(packed)[0], batch_first=True, total_length=x.shape[1])[0]
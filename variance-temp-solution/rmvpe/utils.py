@@ -1,29 +1,130 @@
-import librosa
 import numpy as np
-import torch
 
 from .constants import *
 
 
-def to_local_average_f0(hidden, center=None, thred=0.03):
-    idx = torch.arange(N_CLASS, device=hidden.device)[None, None, :]  # [B=1, T=1, N]
-    idx_cents = idx * 20 + CONST  # [B=1, N]
+def to_local_average_f0(hidden, center=None, thred=0.03, chunk_size=4096):
+    """
+    :param hidden: [B, T, N] salience, or [T, N] for a single sequence
+    :param center: [B, T, 1] (or [T, 1]) bins to average around, the peak of each frame if not specified
+    :return: [B, T] f0 (or [T]), 0 where unvoiced
+    """
+    if hidden.ndim == 2:
+        return to_local_average_f0(
+            hidden[None], center=center[None] if center is not None else None, thred=thred, chunk_size=chunk_size
+        )[0]
+    # Decode chunk by chunk along time so that temporaries stay small on long inputs
+    B, T, _ = hidden.shape
+    f0 = np.empty((B, T), dtype=np.float32)
+    for start in range(0, T, chunk_size):
+        end = start + chunk_size
+        f0[:, start: end] = _local_average_f0(
+            hidden[:, start: end], center=center[:, start: end] if center is not None else None, thred=thred
+        )
+    return f0
+
+
+def _local_average_f0(hidden, center=None, thred=0.03):
     if center is None:
-        center = torch.argmax(hidden, dim=2, keepdim=True)  # [B, T, 1]
-    start = torch.clip(center - 4, min=0)  # [B, T, 1]
-    end = torch.clip(center + 5, max=N_CLASS)  # [B, T, 1]
-    idx_mask = (idx >= start) & (idx < end)  # [B, T, N]
-    weights = hidden * idx_mask  # [B, T, N]
-    product_sum = torch.sum(weights * idx_cents, dim=2)  # [B, T]
-    weight_sum = torch.sum(weights, dim=2)  # [B, T]
+        center = np.argmax(hidden, axis=2)[:, :, None]  # [B, T, 1]
+        salience_max = np.take_along_axis(hidden, center, axis=2)[:, :, 0]  # [B, T]
+    else:
+        salience_max = hidden.max(axis=2)  # [B, T]
+    # Only gather the 9 bins around the center instead of masking all N bins
+    idx = center + np.arange(-4, 5)[None, None, :]  # [B, T, 9]
+    idx_mask = (idx >= 0) & (idx < N_CLASS)  # [B, T, 9]
+    idx = np.clip(idx, 0, N_CLASS - 1)
+    idx_cents = (idx * 20 + CONST).astype(np.float32)  # [B, T, 9]
+    weights = np.take_along_axis(hidden, idx, axis=2) * idx_mask  # [B, T, 9]
+    product_sum = np.sum(weights * idx_cents, axis=2)  # [B, T]
+    weight_sum = np.sum(weights, axis=2)  # [B, T]
     cents = product_sum / (weight_sum + (weight_sum == 0))  # avoid dividing by zero, [B, T]
     f0 = 10 * 2 ** (cents / 1200)
-    uv = hidden.max(dim=2)[0] < thred  # [B, T]
+    uv = salience_max < thred  # [B, T]
     f0 = f0 * ~uv
-    return f0.squeeze(0).cpu().numpy()
+    return f0
+
+
+def _viterbi_out_of_band(value, best_in, best_in_src, band, log_trans_out):
+    # Best sources below and above the band of each destination, from running maxima of the
+    # previous values (ties are resolved to the lowest state as in librosa)
+    B, N = value.shape
+    states = np.arange(N)
+    neg_inf = np.full((B, 1), -np.inf)
+    prefix_max = np.maximum.accumulate(value, axis=1)
+    prefix_new = value > np.concatenate((neg_inf, prefix_max[:, :-1]), axis=1)
+    prefix_arg = np.maximum.accumulate(np.where(prefix_new, states, 0), axis=1)
+    rev = value[:, ::-1]
+    suffix_max = np.maximum.accumulate(rev, axis=1)
+    suffix_new = rev >= np.concatenate((neg_inf, suffix_max[:, :-1]), axis=1)
+    suffix_arg = (N - 1 - np.maximum.accumulate(np.where(suffix_new, states, 0), axis=1))[:, ::-1]
+    suffix_max = suffix_max[:, ::-1]
+    below = np.clip(states - band - 1, 0, N - 1)
+    above = np.clip(states + band + 1, 0, N - 1)
+    best_below = np.where(states - band - 1 >= 0, prefix_max[:, below], -np.inf) + log_trans_out
+    best_above = np.where(states + band + 1 < N, suffix_max[:, above], -np.inf) + log_trans_out
+
+    take_below = (best_below >= best_in) & (best_below >= best_above)
+    take_in = ~take_below & (best_in >= best_above)
+    best = np.where(take_below, best_below, np.where(take_in, best_in, best_above))
+    best_src = np.where(take_below, prefix_arg[:, below], np.where(take_in, best_in_src, suffix_arg[:, above]))
+    return best, best_src
+
+
+def viterbi_banded(log_prob, log_trans, band):
+    """
+    Viterbi decoding for transition matrices whose entries are (numerically) constant outside a
+    band of +-band states around the diagonal. Gives the same paths as librosa.sequence.viterbi
+    with a uniform initial distribution, in O(T * N * band) instead of O(T * N^2).
+    :param log_prob: [B, T, N] log emission probabilities
+    :param log_trans: [N, N] log transition matrix (from, to)
+    :param band: half width of the band
+    :return: [B, T] most likely state sequences
+    """
+    B, T, N = log_prob.shape
+    width = 2 * band + 1
+    states = np.arange(N)
+    # src[j, k] = j - band + k is the k-th candidate source state of destination j
+    src = states[:, None] - band + np.arange(width)[None, :]  # [N, W]
+    src_valid = (src >= 0) & (src < N)
+    src = np.clip(src, 0, N - 1)
+    log_trans_band = np.where(src_valid, log_trans[src, states[:, None]], -np.inf)  # [N, W]
+    # All transitions outside the band share the same weight
+    log_trans_out = log_trans[0, -1]
+    assert np.all(log_trans[np.abs(states[:, None] - states[None, :]) > band] == log_trans_out)
+
+    value = log_prob[:, 0, :] + np.log(1. / N + np.finfo(log_prob.dtype).tiny)  # [B, N]
+    ptr = np.zeros((B, T, N), dtype=np.uint16)
+    value_pad = np.full((B, N + 2 * band), -np.inf)
+    windows = np.lib.stride_tricks.sliding_window_view(value_pad, width, axis=1)  # [B, N, W], a view
+    for t in range(1, T):
+        value_pad[:, band: band + N] = value
+        scores = windows + log_trans_band
+        best_k = np.argmax(scores, axis=2)  # [B, N]
+        best = np.max(scores, axis=2)
+        best_src = states - band + best_k
+        # Jumps outside the band can only win when the best source overall beats some in-band candidate
+        best_out = value.max(axis=1, keepdims=True) + log_trans_out
+        if np.any(best <= best_out):
+            best, best_src = _viterbi_out_of_band(value, best, best_src, band, log_trans_out)
+        ptr[:, t] = best_src
+        value = log_prob[:, t, :] + best
+
+    batch_idx = np.arange(B)
+    path = np.zeros((B, T), dtype=np.int64)
+    path[:, -1] = np.argmax(value, axis=1)
+    for t in range(T - 2, -1, -1):
+        path[:, t] = ptr[batch_idx, t + 1, path[:, t + 1]]
+    return path
 
 
 def to_viterbi_f0(hidden, thred=0.03):
+    """
+    :param hidden: [B, T, N] salience, or [T, N] for a single sequence
+    :return: [B, T] f0 (or [T]) along the most likely path of bins, 0 where unvoiced
+    """
+    if hidden.ndim == 2:
+        return to_viterbi_f0(hidden[None], thred=thred)[0]
     # Create viterbi transition matrix
     if not hasattr(to_viterbi_f0, 'transition'):
         xx, yy = np.meshgrid(range(N_CLASS), range(N_CLASS))
@@ -31,13 +132,38 @@ def to_viterbi_f0(hidden, thred=0.03):
         transition = transition / transition.sum(axis=1, keepdims=True)
         to_viterbi_f0.transition = transition
 
-    # Convert to probability
-    prob = hidden.squeeze(0).cpu().numpy()
-    prob = prob.T
-    prob = prob / prob.sum(axis=0)
+    # Convert to probability (frames skipped by the silence gate have zero salience)
+    epsilon = np.finfo(hidden.dtype).tiny
+    prob = hidden / np.maximum(hidden.sum(axis=2, keepdims=True), epsilon)  # [B, T, N]
 
-    # Perform viterbi decoding
-    path = librosa.sequence.viterbi(prob, to_viterbi_f0.transition).astype(np.int64)
-    center = torch.from_numpy(path).unsqueeze(0).unsqueeze(-1).to(hidden.device)
+    # Perform viterbi decoding, the transition matrix is non-zero only within +-29 bins
+    path = viterbi_banded(np.log(prob + epsilon), np.log(to_viterbi_f0.transition + epsilon), band=29)
+    center = path[:, :, None]
 
     return to_local_average_f0(hidden, center=center, thred=thred)
+
+
+def make_calibration_audio(sample_rate=SAMPLE_RATE, seconds=4., seed=0):
+    # Harmonic tones with glides and vibrato, separated by silence and breath-like noise
+    rng = np.random.RandomState(seed)
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    f0 = 220 * 2 ** (t / seconds + np.sin(2 * np.pi * 5.5 * t) * 0.025)
+    phase = 2 * np.pi * np.cumsum(f0) / sample_rate
+    audio = sum(
+        np.sin(k * phase) / k * (k * f0 < sample_rate / 2)
+        for k in range(1, 16)
+    ) * 0.3
+    segment = len(t) // 8
+    audio[:segment] = 0
+    audio[3 * segment: 4 * segment] = rng.randn(segment) * 0.02
+    audio[6 * segment: 7 * segment] = 0
+    return audio.astype(np.float32)
+
+
+def cents_error(f0_ref, f0_est):
+    voiced = (f0_ref > 0) & (f0_est > 0)
+    return np.abs(1200 * np.log2(f0_est[voiced] / f0_ref[voiced]))
+
+
+def voicing_agreement(f0_ref, f0_est):
+    return np.mean((f0_ref > 0) == (f0_est > 0))
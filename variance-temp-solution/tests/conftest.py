@@ -0,0 +1,5 @@
+import pathlib
+import sys
+
+# The scripts and packages of this directory are imported as top-level modules
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent))
@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+SAMPLE_RATE = 16000
+
+
+def make_audio(gap):
+    # 15 seconds of a tone, 25 seconds of gap, then 30 seconds of the tone again
+    t = np.arange(SAMPLE_RATE * 15) / SAMPLE_RATE
+    tone = 0.5 * np.sin(2 * np.pi * 220 * t)
+    if gap == 'noise':
+        gap = 0.1 * np.random.default_rng(0).standard_normal(SAMPLE_RATE * 25)
+    else:
+        gap = np.zeros(SAMPLE_RATE * 25)
+    return np.concatenate([tone, gap, tone, tone])
+
+
+@pytest.mark.parametrize('gap', ['silence', 'noise'])
+def test_chunked_matches_whole_file(gap):
+    from parselmouth_engine import ParselmouthEngine
+
+    # Chunks of 10 seconds, some of them only silence or noise, which have more candidates per frame than the tone
+    audio = make_audio(gap)
+    params = {'time_step': 0.01, 'pitch_floor': 65., 'pitch_ceiling': 1100., 'voicing_threshold': (0.45, 0.6)}
+    whole = list(ParselmouthEngine(num_workers=1).to_pitch_ac([(audio, SAMPLE_RATE)], **params))[0]
+    engine = ParselmouthEngine(num_workers=2, chunk_seconds=10.)
+    try:
+        assert engine._split(audio.shape[0], SAMPLE_RATE, params) is not None
+        chunked = list(engine.to_pitch_ac([(audio, SAMPLE_RATE)], **params))[0]
+    finally:
+        engine.shutdown()
+
+    for f0_whole, f0_chunked in zip(whole, chunked):
+        np.testing.assert_array_equal(f0_chunked, f0_whole)
@@ -0,0 +1,25 @@
+import pathlib
+
+import numpy as np
+import pytest
+
+CHECKPOINT = pathlib.Path(__file__).parent.parent / 'assets' / 'rmvpe' / 'model.pt'
+
+
+@pytest.mark.skipif(not CHECKPOINT.exists(), reason='RMVPE checkpoint not found in assets/rmvpe')
+def test_chunked_matches_whole_file():
+    from rmvpe import RMVPE
+    from rmvpe.constants import SAMPLE_RATE
+    from rmvpe.utils import cents_error, make_calibration_audio, voicing_agreement
+
+    # 40 seconds are 4000 frames, i.e. 4 chunks of 1024 frames with 1440 frames of context on both sides
+    rmvpe = RMVPE(CHECKPOINT, chunk_frames=1024)
+    audio = make_calibration_audio(seconds=40.)
+    f0_whole = rmvpe._infer_batch([audio], SAMPLE_RATE)[0]
+    f0_chunked = rmvpe._infer_chunked(audio, SAMPLE_RATE)
+
+    assert f0_chunked.shape == f0_whole.shape
+    assert voicing_agreement(f0_whole, f0_chunked) >= 0.999
+    cents = cents_error(f0_whole, f0_chunked)
+    assert cents.shape[0] > 0
+    assert cents.max() < 1.
@@ -0,0 +1,37 @@
+import numpy as np
+
+
+def make_salience(batch_size, n_frames, seed=0):
+    # Peaks of a few bins around wandering pitches over low noise, with unvoiced stretches
+    from rmvpe.constants import N_CLASS
+    rng = np.random.default_rng(seed)
+    bins = np.arange(N_CLASS)
+    hidden = rng.uniform(0, 0.02, (batch_size, n_frames, N_CLASS)).astype(np.float32)
+    for b in range(batch_size):
+        center = 180 + 100 * np.sin(np.arange(n_frames) / (40 + 20 * b)) + rng.normal(0, 3, n_frames)
+        # Occasional octave jumps, which the transition matrix penalizes
+        center[rng.random(n_frames) < 0.05] += 60
+        hidden[b] += 0.9 * np.exp(-0.5 * ((bins - center[:, None]) / 1.5) ** 2)
+        hidden[b, (np.arange(n_frames) // 50) % 4 == 0] *= 0.01
+    return hidden
+
+
+def dense_viterbi_f0(hidden, thred=0.03):
+    # The previous decoder, running librosa.sequence.viterbi over all bins of one sequence
+    import librosa
+    from rmvpe.utils import to_local_average_f0, to_viterbi_f0
+    to_viterbi_f0(hidden[:1])  # builds the transition matrix
+    prob = hidden.T / hidden.T.sum(axis=0)
+    path = librosa.sequence.viterbi(prob, to_viterbi_f0.transition).astype(np.int64)
+    return to_local_average_f0(hidden, center=path[:, None], thred=thred)
+
+
+def test_batched_viterbi_matches_dense():
+    from rmvpe.utils import to_viterbi_f0
+
+    hidden = make_salience(batch_size=3, n_frames=400)
+    f0 = to_viterbi_f0(hidden)
+    assert f0.shape == (3, 400)
+    for b in range(hidden.shape[0]):
+        np.testing.assert_allclose(f0[b], dense_viterbi_f0(hidden[b]), rtol=1e-6)
+        np.testing.assert_array_equal(to_viterbi_f0(hidden[b]), f0[b])
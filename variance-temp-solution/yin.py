@@ -0,0 +1,80 @@
+import math
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def _next_pow2(n):
+    return 1 << (int(n) - 1).bit_length()
+
+
+def _difference(frames, win_length, n_fft):
+    """
+    Cumulative mean normalized difference function of YIN for every frame (row), for lags 0 to
+    frames.shape[1] - win_length, with the autocorrelation of all frames computed at once by FFT.
+    """
+    max_lag = frames.shape[1] - win_length
+    spec = np.fft.rfft(frames, n=n_fft, axis=1)
+    spec *= np.conj(np.fft.rfft(frames[:, :win_length], n=n_fft, axis=1))
+    acf = np.fft.irfft(spec, n=n_fft, axis=1)[:, :max_lag + 1]
+    # d(tau) = sum((x[j] - x[j + tau]) ** 2) = energy(0) + energy(tau) - 2 * acf(tau), for j < win_length
+    power = np.cumsum(np.pad(frames ** 2, ((0, 0), (1, 0))), axis=1)
+    energy = power[:, win_length: win_length + max_lag + 1] - power[:, :max_lag + 1]
+    diff = np.maximum(energy[:, :1] + energy - 2 * acf, 0)
+    diff[:, 0] = 0
+    cum = np.cumsum(diff[:, 1:], axis=1)
+    cmnd = np.ones_like(diff)
+    np.divide(diff[:, 1:] * np.arange(1, max_lag + 1), cum, out=cmnd[:, 1:], where=cum > 0)
+    return cmnd
+
+
+def _pick(cmnd, min_lag, threshold, sample_rate):
+    # The first trough below the threshold within the lag range, refined by parabolic interpolation
+    lags = cmnd[:, min_lag - 1:]
+    trough = (lags[:, 1:-1] < threshold) & (lags[:, 1:-1] <= lags[:, :-2]) & (lags[:, 1:-1] < lags[:, 2:])
+    voiced = trough.any(axis=1)
+    best = np.argmax(trough, axis=1) + 1
+    rows = np.arange(lags.shape[0])
+    left, center, right = lags[rows, best - 1], lags[rows, best], lags[rows, best + 1]
+    curvature = left - 2 * center + right
+    shift = np.zeros_like(center)
+    np.divide(left - right, 2 * curvature, out=shift, where=curvature > 0)
+    period = best + min_lag - 1 + np.clip(shift, -1, 1)
+    return np.where(voiced, sample_rate / period, 0)
+
+
+def yin_batch(wav_datas, sample_rate, hop_size, f0_min=65., f0_max=1100., threshold=0.15, block_size=2048):
+    """
+    Extract f0 of many waveforms at once with YIN. Frame i of each waveform is centred at i * hop_size
+    (hop_size may be fractional); there are ceil(len(waveform) / hop_size) frames, 0 where unvoiced.
+    This is the frame grid of RMVPE, not of parselmouth: Praat centres its floor((duration - 3 / f0_min)
+    / time_step) + 1 frames in the sound, so frame i of parselmouth is about 1.5 / f0_min seconds later
+    (plus up to half a frame), and parselmouth returns fewer frames.
+    Frames of all waveforms are taken from one concatenated buffer and analysed block_size frames at a time.
+    :return: list of f0 arrays
+    """
+    max_lag = int(math.ceil(sample_rate / f0_min))
+    min_lag = max(int(math.floor(sample_rate / f0_max)), 2)
+    win_length = max_lag + 1
+    frame_length = win_length + max_lag + 1
+    n_fft = _next_pow2(frame_length)
+    # The difference function compares the win_length samples centred on the frame with lagged copies
+    half = win_length // 2
+
+    lengths = [int(math.ceil(wav_data.shape[0] / hop_size)) for wav_data in wav_datas]
+    # Each waveform padded with zeros to contain all of its frames
+    padded = [np.pad(np.asarray(wav_data, dtype=np.float32), (half, frame_length)) for wav_data in wav_datas]
+    offsets = np.cumsum([0] + [p.shape[0] for p in padded])
+    starts = np.concatenate([
+        offsets[i] + np.round(np.arange(length) * hop_size).astype(np.int64)
+        for i, length in enumerate(lengths)
+    ] + [np.zeros(0, dtype=np.int64)])
+    if starts.shape[0] == 0:
+        return [np.zeros(0) for _ in wav_datas]
+    windows = sliding_window_view(np.concatenate(padded), frame_length)
+    f0 = np.empty(starts.shape[0])
+    for i in range(0, starts.shape[0], block_size):
+        frames = windows[starts[i: i + block_size]]
+        f0[i: i + block_size] = _pick(_difference(frames, win_length, n_fft), min_lag, threshold, sample_rate)
+    bounds = np.cumsum([0] + lengths)
+    return [f0[bounds[i]: bounds[i + 1]] for i in range(len(wav_datas))]